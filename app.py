@@ -9,7 +9,7 @@ import json
 import re
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
-from storage_service import create_storage_service, StorageService
+from storage_service import create_storage_service, S3StorageService, StorageService
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
@@ -918,15 +918,19 @@ def extract_html_from_response(ai_response):
         cleaned = convert_markdown_to_html(cleaned)
         return cleaned, f"تم استخراج المحتوى: {str(e)}"
 
-def convert_audio_to_transcript(audio_file_path):
-    """Convert audio file to transcript using ElevenLabs Speech-to-Text API"""
+def convert_audio_to_transcript(audio_file_path, audio_data=None):
+    """Convert audio file to transcript using ElevenLabs Speech-to-Text API
+
+    If audio_data (the file's bytes) is given, it is sent as-is and
+    audio_file_path only supplies the upload's filename.
+    """
     if not ELEVENLABS_ENABLED:
         return {
             'success': False,
             'error': 'ElevenLabs API key not configured'
         }
     
-    if not os.path.exists(audio_file_path):
+    if audio_data is None and not os.path.exists(audio_file_path):
         return {
             'success': False,
             'error': 'Audio file not found'
@@ -941,9 +945,14 @@ def convert_audio_to_transcript(audio_file_path):
         }
         
         # Prepare form data
-        files = {
-            'file': open(audio_file_path, 'rb')
-        }
+        if audio_data is not None:
+            files = {
+                'file': (os.path.basename(audio_file_path), audio_data)
+            }
+        else:
+            files = {
+                'file': open(audio_file_path, 'rb')
+            }
         
         data = {
             'model_id': 'scribe_v1',  # Use the standard model
@@ -963,7 +972,8 @@ def convert_audio_to_transcript(audio_file_path):
         )
         
         # Close the file
-        files['file'].close()
+        if audio_data is None:
+            files['file'].close()
         
         if response.status_code == 200:
             result = response.json()
@@ -2239,6 +2249,7 @@ def delete_voice_note(note_id):
         }), 500
 
 @app.route('/voice_recordings/<filename>')
+@app.route('/media/<filename>')
 @login_required
 def serve_voice_recording(filename):
     """Serve voice recording files"""
@@ -2257,10 +2268,17 @@ def serve_voice_recording(filename):
         
         # For S3, get presigned URL and redirect
         # For local storage, serve the file from filesystem
-        if hasattr(storage, 's3_client'):  # S3 storage
-            # Generate presigned URL (temporary, expires in 1 hour)
-            presigned_url = storage.get_file_url(filename)
-            return redirect(presigned_url)
+        if isinstance(storage, S3StorageService):  # S3 storage
+            # Generate presigned URL (temporary, expires in 1 hour). The signature is
+            # cached server-side, so the browser may cache the redirect until shortly
+            # before it expires instead of asking again on every render
+            presigned_url, max_age = storage.get_file_url_with_max_age(filename)
+            response = redirect(presigned_url, code=302)
+            if max_age > 0:
+                response.headers['Cache-Control'] = f'private, max-age={max_age}'
+            else:
+                response.headers['Cache-Control'] = 'no-store'
+            return response
         else:  # Local storage
             # Serve from local filesystem
             return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
@@ -2288,52 +2306,40 @@ def generate_transcript(recording_id):
         # Get storage service
         storage = get_storage_service()
         
-        # If using S3, download file temporarily for transcription
-        if hasattr(storage, 's3_client'):  # S3 storage
-            import tempfile
-            # Create temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(recording.filename)[1]) as tmp_file:
-                temp_path = tmp_file.name
-                
-            # Download from S3
-            if not storage.download_file(recording.filename, temp_path):
+        # If using S3, fetch the recording into memory for transcription
+        if isinstance(storage, S3StorageService):  # S3 storage
+            audio_data = storage.download_bytes(recording.filename)
+            if audio_data is None:
                 return jsonify({
                     'success': False,
                     'message': 'فشل في تحميل الملف من التخزين'
                 }), 500
-            
-            audio_file_path = temp_path
-            cleanup_temp = True
+            audio_file_path = recording.filename
         else:  # Local storage
+            audio_data = None
             audio_file_path = os.path.join(app.config['UPLOAD_FOLDER'], recording.filename)
-            cleanup_temp = False
         
-        try:
-            # Convert audio to transcript
-            result = convert_audio_to_transcript(audio_file_path)
+        # Convert audio to transcript
+        result = convert_audio_to_transcript(audio_file_path, audio_data)
+        
+        if result['success']:
+            # Save transcript to database
+            recording.transcription = result['text']
+            db.session.commit()
             
-            if result['success']:
-                # Save transcript to database
-                recording.transcription = result['text']
-                db.session.commit()
-                
-                return jsonify({
-                    'success': True,
-                    'transcript': result['text'],
-                    'language_code': result.get('language_code', ''),
-                    'language_probability': result.get('language_probability', 0),
-                    'message': 'تم تحويل التسجيل إلى نص بنجاح',
-                    'cached': False
-                })
-            else:
-                return jsonify({
-                    'success': False,
-                    'message': f'فشل في تحويل التسجيل: {result["error"]}'
-                }), 500
-        finally:
-            # Clean up temporary file if S3 was used
-            if cleanup_temp and os.path.exists(audio_file_path):
-                os.remove(audio_file_path)
+            return jsonify({
+                'success': True,
+                'transcript': result['text'],
+                'language_code': result.get('language_code', ''),
+                'language_probability': result.get('language_probability', 0),
+                'message': 'تم تحويل التسجيل إلى نص بنجاح',
+                'cached': False
+            })
+        else:
+            return jsonify({
+                'success': False,
+                'message': f'فشل في تحويل التسجيل: {result["error"]}'
+            }), 500
             
     except Exception as e:
         db.session.rollback()
@@ -4159,16 +4165,20 @@ def admin_user_delete(user_id):
     return redirect(url_for('admin_users'))
 
 if __name__ == '__main__':
-    init_db()
+    # Development server only; production runs wsgi:app under gunicorn, and
+    # tables are created once with INIT_DB=1 (or wsgi.init_db())
+    if os.environ.get('INIT_DB', '').lower() in ('1', 'true', 'yes'):
+        init_db()
     port = int(os.environ.get('PORT', 5000))
     host = '0.0.0.0' if port != 5000 else '127.0.0.1'
+    debug = os.environ.get('FLASK_DEBUG', '').lower() in ('1', 'true', 'yes')
     
     # Enable threaded mode to handle multiple requests
     print("🚀 Starting Flask server...")
     print(f"   - Host: {host}")
     print(f"   - Port: {port}")
-    print(f"   - Debug: True")
+    print(f"   - Debug: {debug}")
     print(f"   - Threaded: True")
     print("="*80)
     
-    app.run(debug=True, host=host, port=port, threaded=True, use_reloader=True) 
\ No newline at end of file
+    app.run(debug=debug, host=host, port=port, threaded=True, use_reloader=debug) 
\ No newline at end of file
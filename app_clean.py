@@ -1,70 +1,123 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, abort, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func, case, event, update, insert
+from collections import OrderedDict
 from datetime import datetime
 import os
+import logging
 import google.generativeai as genai
-import json
+import orjson
 import re
+import threading
+import time
+
+class OrJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson; types orjson can't encode go through Flask's default hook"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = OrJSONProvider(app)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///team_planning.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Number of rows shown per page on list views
+PER_PAGE = 25
+
 db = SQLAlchemy(app)
 
+def _set_sqlite_pragmas(dbapi_conn, _connection_record):
+    """Use WAL so readers don't block the writer, and relax fsync to once per checkpoint"""
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")  # 256MB
+    cursor.execute("PRAGMA cache_size=-65536")  # 64MB
+    cursor.close()
+
+# Registered at import time rather than in init_db() so every pooled
+# connection gets the pragmas, including under `flask run` / WSGI servers
+with app.app_context():
+    event.listen(db.engine, "connect", _set_sqlite_pragmas)
+
+# Development only (FLASK_DEBUG=1): warn about lazy loads issued in loops.
+# nplusone is listed in requirements-dev.txt and never ships to production.
+if app.debug:
+    try:
+        from nplusone.ext.flask_sqlalchemy import NPlusOne
+    except ImportError:
+        print("⚠️ nplusone not installed - run: pip install -r requirements-dev.txt")
+    else:
+        nplusone_logger = logging.getLogger('nplusone')
+        nplusone_logger.addHandler(logging.StreamHandler())  # stderr, next to the Flask logs
+        app.config['NPLUSONE_LOGGER'] = nplusone_logger
+        app.config['NPLUSONE_LOG_LEVEL'] = logging.WARN
+        NPlusOne(app)
+
 # Database Models
 class Task(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
-    status = db.Column(db.String(20), default='pending')  # pending, in_progress, completed
+    status = db.Column(db.String(20), default='pending', index=True)  # pending, in_progress, completed
     priority = db.Column(db.String(10), default='medium')  # low, medium, high
     assigned_to = db.Column(db.String(100))
     due_date = db.Column(db.Date)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    category = db.Column(db.String(50), default='general')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    category = db.Column(db.String(50), default='general', index=True)
 
 class Resource(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
     url = db.Column(db.String(500))
-    resource_type = db.Column(db.String(50))  # document, link, file, note
+    resource_type = db.Column(db.String(50), index=True)  # document, link, file, note
     tags = db.Column(db.String(200))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     created_by = db.Column(db.String(100))
 
 class BrainstormSession(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
-    status = db.Column(db.String(20), default='active')  # active, completed, archived
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    status = db.Column(db.String(20), default='active', index=True)  # active, completed, archived
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     created_by = db.Column(db.String(100))
 
 class Idea(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
-    session_id = db.Column(db.Integer, db.ForeignKey('brainstorm_session.id'), nullable=False)
+    session_id = db.Column(db.Integer, db.ForeignKey('brainstorm_session.id'), nullable=False, index=True)
     author = db.Column(db.String(100))
-    votes = db.Column(db.Integer, default=0)
+    votes = db.Column(db.Integer, default=0, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Matches the brainstorm_session() ORDER BY votes DESC, created_at DESC
+    __table_args__ = (
+        db.Index('ix_idea_session_votes', 'session_id', db.desc('votes'), db.desc('created_at')),
+    )
 
 class SmartNotion(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     content_html = db.Column(db.Text, nullable=False)
     created_by = db.Column(db.String(100))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
 class ChatConversation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    notion_id = db.Column(db.Integer, db.ForeignKey('smart_notion.id'), nullable=False)
+    notion_id = db.Column(db.Integer, db.ForeignKey('smart_notion.id'), nullable=False, index=True)
     user_message = db.Column(db.Text, nullable=False)
     ai_response = db.Column(db.Text, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
 # Gemini AI Configuration
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', '')
@@ -73,56 +126,65 @@ GEMINI_ENABLED = bool(GEMINI_API_KEY and GEMINI_API_KEY != 'your-gemini-api-key-
 if GEMINI_ENABLED:
     genai.configure(api_key=GEMINI_API_KEY)
 
-def test_gemini_connection():
-    """Test Gemini AI connection and return available models"""
+# Preferred models in order of preference (newest first)
+PREFERRED_GEMINI_MODELS = (
+    'models/gemini-2.5-flash',
+    'models/gemini-2.5-pro',
+    'models/gemini-2.5-pro-preview-06-05',
+    'models/gemini-2.0-flash-exp',
+    'models/gemini-1.5-pro',
+    'models/gemini-1.5-flash',
+    'models/gemini-pro',
+    'models/gemini-1.0-pro',
+)
+
+# Initial content for a newly created smart notion
+DEFAULT_NOTION_HTML = '<div class="text-center p-8 bg-gradient-to-r from-cyan-50 to-blue-50 rounded-lg border border-cyan-200"><h2 class="text-2xl font-bold text-cyan-950 mb-4">🎉 مرحباً بك في ملاحظتك الذكية الجديدة!</h2><p class="text-gray-700 mb-6">استخدم نافذة الدردشة على اليمين لبدء إنشاء المحتوى</p><div class="bg-white p-4 rounded-lg shadow-sm border border-cyan-100"><h3 class="font-semibold text-cyan-800 mb-2">💡 أمثلة على ما يمكنك طلبه:</h3><ul class="text-right space-y-1 text-gray-600"><li>• "أنشئ قائمة مهام لمشروع جديد"</li><li>• "اكتب خطة عمل لثلاثة أشهر"</li><li>• "أضف جدول للمواعيد الأسبوعية"</li><li>• "أنشئ قسم للملاحظات والأفكار"</li></ul></div></div>'
+
+# How long the list_models() result is reused before asking the API again
+MODEL_LIST_TTL_SECONDS = 300
+_model_list_cache = None  # (expires_at, (ok, available_models, best_model))
+
+def _fetch_models_and_pick():
+    """List the available Gemini models once and pick the best one.
+    
+    Returns (ok, available_models, best_model). When the API call fails,
+    available_models holds the error message. Successful lookups are cached
+    for MODEL_LIST_TTL_SECONDS.
+    """
+    global _model_list_cache
     if not GEMINI_ENABLED:
-        return False, "API key not configured"
+        return False, "API key not configured", None
+    
+    now = time.monotonic()
+    if _model_list_cache is not None and now < _model_list_cache[0]:
+        return _model_list_cache[1]
     
     try:
-        # List available models to check connection
         models = genai.list_models()
-        available_models = []
-        for model in models:
-            if 'generateContent' in model.supported_generation_methods:
-                available_models.append(model.name)
-        
-        return True, available_models
+        available_models = [m.name for m in models if 'generateContent' in m.supported_generation_methods]
     except Exception as e:
-        return False, str(e)
+        return False, str(e), 'models/gemini-1.5-pro'  # Default fallback
+    
+    # First preferred model that's available, otherwise the first available one
+    available_set = set(available_models)
+    best_model = next(
+        (preferred for preferred in PREFERRED_GEMINI_MODELS if preferred in available_set),
+        available_models[0] if available_models else None
+    )
+    
+    result = (True, available_models, best_model)
+    _model_list_cache = (now + MODEL_LIST_TTL_SECONDS, result)
+    return result
+
+def test_gemini_connection():
+    """Test Gemini AI connection and return available models"""
+    connection_ok, result, _ = _fetch_models_and_pick()
+    return connection_ok, result
 
 def get_best_gemini_model():
     """Get the best available Gemini model"""
-    if not GEMINI_ENABLED:
-        return None
-    
-    # Preferred models in order of preference (newest first)
-    preferred_models = [
-        'models/gemini-2.5-flash', 
-        'models/gemini-2.5-pro',
-        'models/gemini-2.5-pro-preview-06-05',
-        'models/gemini-2.0-flash-exp',
-        'models/gemini-1.5-pro',
-        'models/gemini-1.5-flash',
-        'models/gemini-pro',
-        'models/gemini-1.0-pro'
-    ]
-    
-    try:
-        models = genai.list_models()
-        available_models = [m.name for m in models if 'generateContent' in m.supported_generation_methods]
-        
-        # Return the first preferred model that's available
-        for preferred in preferred_models:
-            if preferred in available_models:
-                return preferred
-                
-        # If no preferred model found, return the first available one
-        if available_models:
-            return available_models[0]
-            
-        return None
-    except Exception:
-        return 'models/gemini-1.5-pro'  # Default fallback
+    return _fetch_models_and_pick()[2]
 
 def print_gemini_model_info():
     """Print detailed information about Gemini model selection and availability"""
@@ -135,30 +197,20 @@ def print_gemini_model_info():
         print("=" * 50)
         
         # Get connection status
-        connection_ok, result = test_gemini_connection()
+        connection_ok, result, selected_model = _fetch_models_and_pick()
         print(f"📡 Connection Status: {'✅ Connected' if connection_ok else '❌ Failed'}")
         
         if connection_ok:
             available_models = result
-            selected_model = get_best_gemini_model()
             
             print(f"🎯 Selected Model: {selected_model}")
             print(f"📊 Total Available Models: {len(available_models)}")
             
             print("\n🏆 Model Priority Order:")
-            preferred_models = [
-                'models/gemini-2.5-flash', 
-                'models/gemini-2.5-pro',
-                'models/gemini-2.5-pro-preview-06-05',
-                'models/gemini-2.0-flash-exp',
-                'models/gemini-1.5-pro',
-                'models/gemini-1.5-flash',
-                'models/gemini-pro',
-                'models/gemini-1.0-pro'
-            ]
+            available_set = set(available_models)
             
-            for i, model in enumerate(preferred_models, 1):
-                status = "✅ AVAILABLE" if model in available_models else "❌ Not Available"
+            for i, model in enumerate(PREFERRED_GEMINI_MODELS, 1):
+                status = "✅ AVAILABLE" if model in available_set else "❌ Not Available"
                 marker = "👑 SELECTED" if model == selected_model else ""
                 print(f"  {i}. {model} - {status} {marker}")
             
@@ -173,24 +225,16 @@ def print_gemini_model_info():
     except Exception as e:
         print(f"❌ Error getting model info: {e}")
 
-def get_gemini_response(user_input, context=""):
-    """Get response from Gemini AI for smart notion creation/modification"""
-    if not GEMINI_ENABLED:
-        return json.dumps({
-            "action": "error",
-            "html_content": "<div class='text-center p-8 bg-yellow-50 border border-yellow-200 rounded-lg'><h3 class='text-lg font-semibold text-yellow-800 mb-2'>⚠️ مطلوب إعداد مفتاح Gemini AI</h3><p class='text-yellow-700'>يرجى تكوين متغير البيئة GEMINI_API_KEY لاستخدام الملاحظات الذكية</p><p class='text-sm text-yellow-600 mt-2'>احصل على مفتاح API من: https://makersuite.google.com/app/apikey</p></div>",
-            "explanation": "مطلوب إعداد مفتاح Gemini AI لاستخدام هذه الميزة"
-        })
-    
-    try:
-        # Get the best available model
-        model_name = get_best_gemini_model()
-        if not model_name:
-            raise Exception("No compatible Gemini models available")
-            
-        model = genai.GenerativeModel(model_name)
-        
-        system_prompt = f"""
+# Returned instead of a model response when GEMINI_API_KEY is missing
+GEMINI_NOT_CONFIGURED_RESPONSE = orjson.dumps({
+    "action": "error",
+    "html_content": "<div class='text-center p-8 bg-yellow-50 border border-yellow-200 rounded-lg'><h3 class='text-lg font-semibold text-yellow-800 mb-2'>⚠️ مطلوب إعداد مفتاح Gemini AI</h3><p class='text-yellow-700'>يرجى تكوين متغير البيئة GEMINI_API_KEY لاستخدام الملاحظات الذكية</p><p class='text-sm text-yellow-600 mt-2'>احصل على مفتاح API من: https://makersuite.google.com/app/apikey</p></div>",
+    "explanation": "مطلوب إعداد مفتاح Gemini AI لاستخدام هذه الميزة"
+}).decode()
+
+def _build_notion_prompt(user_input, context):
+    """Build the smart notion system prompt sent to Gemini"""
+    return f"""
         أنت مساعد ذكي لإنشاء وتعديل صفحات الملاحظات الذكية باللغة العربية. 
         
         المهام التي يمكنك القيام بها:
@@ -220,34 +264,63 @@ def get_gemini_response(user_input, context=""):
             "explanation": "شرح مختصر ما تم عمله باللغة العربية"
         }}
         """
-        
-        response = model.generate_content(system_prompt)
+
+def _gemini_error_response(error, model_name=None):
+    """Build the JSON error response shown when the Gemini call fails"""
+    return orjson.dumps({
+        "action": "error",
+        "html_content": f"<div class='text-center p-8 bg-red-50 border border-red-200 rounded-lg'><h3 class='text-lg font-semibold text-red-800 mb-2'>❌ خطأ في الاتصال</h3><p class='text-red-700'>حدث خطأ في الاتصال مع المساعد الذكي</p><p class='text-sm text-red-600 mt-2'>رسالة الخطأ: {str(error)}</p><p class='text-xs text-red-500 mt-1'>النموذج المستخدم: {model_name or 'غير محدد'}</p></div>",
+        "explanation": f"خطأ في الاتصال مع Gemini AI: {str(error)}"
+    }).decode()
+
+def _get_notion_model():
+    """Create a GenerativeModel for the best available Gemini model"""
+    model_name = get_best_gemini_model()
+    if not model_name:
+        raise Exception("No compatible Gemini models available")
+    return genai.GenerativeModel(model_name)
+
+def get_gemini_response(user_input, context=""):
+    """Get response from Gemini AI for smart notion creation/modification"""
+    if not GEMINI_ENABLED:
+        return GEMINI_NOT_CONFIGURED_RESPONSE
+    
+    try:
+        model = _get_notion_model()
+        response = model.generate_content(_build_notion_prompt(user_input, context))
         return response.text
     except Exception as e:
-        return json.dumps({
-            "action": "error",
-            "html_content": f"<div class='text-center p-8 bg-red-50 border border-red-200 rounded-lg'><h3 class='text-lg font-semibold text-red-800 mb-2'>❌ خطأ في الاتصال</h3><p class='text-red-700'>حدث خطأ في الاتصال مع المساعد الذكي</p><p class='text-sm text-red-600 mt-2'>رسالة الخطأ: {str(e)}</p><p class='text-xs text-red-500 mt-1'>النموذج المستخدم: {model_name if 'model_name' in locals() else 'غير محدد'}</p></div>",
-            "explanation": f"خطأ في الاتصال مع Gemini AI: {str(e)}"
-        })
+        return _gemini_error_response(e, get_best_gemini_model())
+
+def stream_gemini_response(user_input, context=""):
+    """Yield the Gemini response text chunk by chunk as it is generated.
+    
+    Unlike get_gemini_response(), API errors propagate to the caller, since
+    part of the response may already have been consumed.
+    """
+    if not GEMINI_ENABLED:
+        yield GEMINI_NOT_CONFIGURED_RESPONSE
+        return
+    
+    model = _get_notion_model()
+    for chunk in model.generate_content(_build_notion_prompt(user_input, context), stream=True):
+        yield chunk.text
+
+# Patterns used to clean up Gemini responses, compiled once at import time
+_RE_MULTI_NL = re.compile(r'\n\s*\n\s*\n+')
+_RE_TRIM = re.compile(r'^\s+|\s+$', re.MULTILINE)
+_RE_FENCE = re.compile(r'^```(?:json)?\s*|\s*```$', re.DOTALL)
+_RE_ANY_FENCE = re.compile(r'```json|```')
+_RE_HTML_FENCE = re.compile(r'```html\n(.*?)\n```', re.DOTALL)
 
 def extract_html_from_response(ai_response):
     """Extract HTML content from AI response and clean it properly"""
     try:
-        # Remove markdown code blocks if present
-        cleaned_response = ai_response.strip()
-        
-        # Remove ```json and ``` wrappers
-        if cleaned_response.startswith('```json'):
-            cleaned_response = cleaned_response[7:]  # Remove ```json
-        if cleaned_response.startswith('```'):
-            cleaned_response = cleaned_response[3:]   # Remove ```
-        if cleaned_response.endswith('```'):
-            cleaned_response = cleaned_response[:-3]  # Remove trailing ```
-        
-        cleaned_response = cleaned_response.strip()
+        # Remove ```json / ``` wrappers in a single pass
+        cleaned_response = _RE_FENCE.sub('', ai_response.strip())
         
         # Try to parse as JSON
-        response_data = json.loads(cleaned_response)
+        response_data = orjson.loads(cleaned_response)
         
         html_content = response_data.get("html_content", "")
         explanation = response_data.get("explanation", "")
@@ -257,22 +330,62 @@ def extract_html_from_response(ai_response):
             # Replace literal \n with actual newlines, then remove extra whitespace
             html_content = html_content.replace('\\n', '\n')
             # Remove excessive newlines and whitespace
-            html_content = re.sub(r'\n\s*\n\s*\n+', '\n\n', html_content)
-            html_content = re.sub(r'^\s+|\s+$', '', html_content, flags=re.MULTILINE)
+            html_content = _RE_MULTI_NL.sub('\n\n', html_content)
+            html_content = _RE_TRIM.sub('', html_content)
             html_content = html_content.strip()
         
         return html_content, explanation
         
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         # If JSON parsing fails, try to extract HTML using regex
-        html_match = re.search(r'```html\n(.*?)\n```', ai_response, re.DOTALL)
+        html_match = _RE_HTML_FENCE.search(ai_response)
         if html_match:
             return html_match.group(1), ai_response
         
         # Last resort: return cleaned response
-        cleaned = re.sub(r'```json|```', '', ai_response).strip()
+        cleaned = _RE_ANY_FENCE.sub('', ai_response).strip()
         return cleaned, f"تم استخراج المحتوى بدون تحليل JSON: {str(e)}"
 
+def _preview(text, limit=200):
+    """Truncate text to limit characters for debug output"""
+    return text if len(text) <= limit else text[:limit] + "..."
+
+# Recent-conversation part of the chat prompt, per notion, as a bounded LRU
+# shared by the worker's request threads:
+# notion_id -> (id of the newest conversation it was built from, history text)
+_chat_context_cache = OrderedDict()
+_chat_context_cache_lock = threading.Lock()
+CHAT_CONTEXT_CACHE_SIZE = 256
+CHAT_HISTORY_LIMIT = 5
+CHAT_RESPONSE_CONTEXT_CHARS = 500
+
+def get_chat_history_context(notion_id, last_conversation_id):
+    """Return the chat history text for a notion's prompt, rebuilding it only when a newer conversation exists"""
+    with _chat_context_cache_lock:
+        cached = _chat_context_cache.get(notion_id)
+        if cached is not None and cached[0] == last_conversation_id:
+            _chat_context_cache.move_to_end(notion_id)
+            return cached[1]
+    
+    history = ""
+    if last_conversation_id is not None:
+        recent_conversations = db.session.query(ChatConversation.user_message, ChatConversation.ai_response)\
+            .filter(ChatConversation.notion_id == notion_id)\
+            .order_by(ChatConversation.id.desc()).limit(CHAT_HISTORY_LIMIT).all()
+        
+        history_parts = ["\nتاريخ المحادثة الأخير:"]
+        for user_message, ai_response in reversed(recent_conversations):  # Reverse to show chronological order
+            history_parts.append(f"المستخدم: {user_message}")
+            history_parts.append(f"المساعد: {ai_response[:CHAT_RESPONSE_CONTEXT_CHARS]}")
+        history = "\n".join(history_parts)
+    
+    with _chat_context_cache_lock:
+        _chat_context_cache[notion_id] = (last_conversation_id, history)
+        _chat_context_cache.move_to_end(notion_id)
+        if len(_chat_context_cache) > CHAT_CONTEXT_CACHE_SIZE:
+            _chat_context_cache.popitem(last=False)
+    return history
+
 # Routes
 @app.route('/')
 def index():
@@ -280,17 +393,16 @@ def index():
     recent_resources = Resource.query.order_by(Resource.created_at.desc()).limit(3).all()
     active_sessions = BrainstormSession.query.filter_by(status='active').limit(3).all()
     
-    # Task statistics
-    total_tasks = Task.query.count()
-    completed_tasks = Task.query.filter_by(status='completed').count()
-    pending_tasks = Task.query.filter_by(status='pending').count()
-    in_progress_tasks = Task.query.filter_by(status='in_progress').count()
+    # Task statistics (one GROUP BY instead of a COUNT per status)
+    status_counts = dict(
+        db.session.query(Task.status, func.count(Task.id)).group_by(Task.status).all()
+    )
     
     stats = {
-        'total': total_tasks,
-        'completed': completed_tasks,
-        'pending': pending_tasks,
-        'in_progress': in_progress_tasks
+        'total': sum(status_counts.values()),
+        'completed': status_counts.get('completed', 0),
+        'pending': status_counts.get('pending', 0),
+        'in_progress': status_counts.get('in_progress', 0)
     }
     
     return render_template('index.html', 
@@ -303,18 +415,23 @@ def index():
 def tasks():
     status_filter = request.args.get('status', 'all')
     category_filter = request.args.get('category', 'all')
+    page = request.args.get('page', 1, type=int)
     
-    query = Task.query
+    # Load plain rows (attribute access still works in templates) to skip ORM hydration
+    query = db.session.query(
+        Task.id, Task.title, Task.description, Task.status, Task.priority,
+        Task.assigned_to, Task.due_date, Task.category, Task.created_at
+    )
     
     if status_filter != 'all':
-        query = query.filter_by(status=status_filter)
+        query = query.filter(Task.status == status_filter)
     if category_filter != 'all':
-        query = query.filter_by(category=category_filter)
+        query = query.filter(Task.category == category_filter)
     
-    tasks = query.order_by(Task.created_at.desc()).all()
+    pagination = query.order_by(Task.created_at.desc()).paginate(page=page, per_page=PER_PAGE, error_out=False)
     categories = db.session.query(Task.category).distinct().all()
     
-    return render_template('tasks.html', tasks=tasks, categories=categories,
+    return render_template('tasks.html', tasks=pagination.items, pagination=pagination, categories=categories,
                          current_status=status_filter, current_category=category_filter)
 
 @app.route('/tasks/new', methods=['GET', 'POST'])
@@ -350,15 +467,19 @@ def update_task_status(task_id):
 @app.route('/resources')
 def resources():
     resource_type = request.args.get('type', 'all')
+    page = request.args.get('page', 1, type=int)
     
-    query = Resource.query
+    query = db.session.query(
+        Resource.id, Resource.title, Resource.description, Resource.url,
+        Resource.resource_type, Resource.tags, Resource.created_by, Resource.created_at
+    )
     if resource_type != 'all':
-        query = query.filter_by(resource_type=resource_type)
+        query = query.filter(Resource.resource_type == resource_type)
     
-    resources = query.order_by(Resource.created_at.desc()).all()
+    pagination = query.order_by(Resource.created_at.desc()).paginate(page=page, per_page=PER_PAGE, error_out=False)
     resource_types = db.session.query(Resource.resource_type).distinct().all()
     
-    return render_template('resources.html', resources=resources, 
+    return render_template('resources.html', resources=pagination.items, pagination=pagination,
                          resource_types=resource_types, current_type=resource_type)
 
 @app.route('/resources/new', methods=['GET', 'POST'])
@@ -381,8 +502,13 @@ def new_resource():
 
 @app.route('/brainstorm')
 def brainstorm():
-    sessions = BrainstormSession.query.order_by(BrainstormSession.created_at.desc()).all()
-    return render_template('brainstorm.html', sessions=sessions)
+    page = request.args.get('page', 1, type=int)
+    query = db.session.query(
+        BrainstormSession.id, BrainstormSession.title, BrainstormSession.description,
+        BrainstormSession.status, BrainstormSession.created_by, BrainstormSession.created_at
+    ).order_by(BrainstormSession.created_at.desc())
+    pagination = query.paginate(page=page, per_page=PER_PAGE, error_out=False)
+    return render_template('brainstorm.html', sessions=pagination.items, pagination=pagination)
 
 @app.route('/brainstorm/new', methods=['GET', 'POST'])
 def new_brainstorm_session():
@@ -402,8 +528,12 @@ def new_brainstorm_session():
 @app.route('/brainstorm/<int:session_id>')
 def brainstorm_session(session_id):
     session = BrainstormSession.query.get_or_404(session_id)
-    ideas = Idea.query.filter_by(session_id=session_id).order_by(Idea.votes.desc(), Idea.created_at.desc()).all()
-    return render_template('brainstorm_session.html', session=session, ideas=ideas)
+    page = request.args.get('page', 1, type=int)
+    # Served by ix_idea_session_votes
+    pagination = Idea.query.filter_by(session_id=session_id)\
+        .order_by(Idea.votes.desc(), Idea.created_at.desc())\
+        .paginate(page=page, per_page=PER_PAGE, error_out=False)
+    return render_template('brainstorm_session.html', session=session, ideas=pagination.items, pagination=pagination)
 
 @app.route('/brainstorm/<int:session_id>/add_idea', methods=['POST'])
 def add_idea(session_id):
@@ -419,34 +549,44 @@ def add_idea(session_id):
 
 @app.route('/api/vote_idea/<int:idea_id>')
 def vote_idea(idea_id):
-    idea = Idea.query.get_or_404(idea_id)
-    idea.votes += 1
+    # Increment in SQL so concurrent votes can't overwrite each other
+    votes = db.session.execute(
+        update(Idea)
+        .where(Idea.id == idea_id)
+        .values(votes=Idea.votes + 1)
+        .returning(Idea.votes)
+    ).scalar_one_or_none()
+    if votes is None:
+        abort(404)
     db.session.commit()
-    return jsonify({'votes': idea.votes})
+    return jsonify({'votes': votes})
 
 @app.route('/smart_notion')
 def smart_notion():
-    notions = SmartNotion.query.order_by(SmartNotion.updated_at.desc()).all()
+    page = request.args.get('page', 1, type=int)
+    pagination = SmartNotion.query.order_by(SmartNotion.updated_at.desc())\
+        .paginate(page=page, per_page=PER_PAGE, error_out=False)
     
-    # Calculate statistics
-    total_notions = SmartNotion.query.count()
-    today_count = SmartNotion.query.filter(
-        SmartNotion.created_at >= datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    ).count()
+    # Calculate statistics in a single aggregate query
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    total_notions, today_count = db.session.query(
+        func.count(SmartNotion.id),
+        func.sum(case((SmartNotion.created_at >= today, 1), else_=0))
+    ).one()
     
     stats = {
         'total': total_notions,
-        'today': today_count
+        'today': today_count or 0
     }
     
-    return render_template('smart_notion.html', notions=notions, stats=stats)
+    return render_template('smart_notion.html', notions=pagination.items, pagination=pagination, stats=stats)
 
 @app.route('/smart_notion/new', methods=['GET', 'POST'])
 def new_smart_notion():
     if request.method == 'POST':
         notion = SmartNotion(
             title=request.form['title'],
-            content_html='<div class="text-center p-8 bg-gradient-to-r from-cyan-50 to-blue-50 rounded-lg border border-cyan-200"><h2 class="text-2xl font-bold text-cyan-950 mb-4">🎉 مرحباً بك في ملاحظتك الذكية الجديدة!</h2><p class="text-gray-700 mb-6">استخدم نافذة الدردشة على اليمين لبدء إنشاء المحتوى</p><div class="bg-white p-4 rounded-lg shadow-sm border border-cyan-100"><h3 class="font-semibold text-cyan-800 mb-2">💡 أمثلة على ما يمكنك طلبه:</h3><ul class="text-right space-y-1 text-gray-600"><li>• "أنشئ قائمة مهام لمشروع جديد"</li><li>• "اكتب خطة عمل لثلاثة أشهر"</li><li>• "أضف جدول للمواعيد الأسبوعية"</li><li>• "أنشئ قسم للملاحظات والأفكار"</li></ul></div></div>',
+            content_html=DEFAULT_NOTION_HTML,
             created_by=request.form.get('created_by', 'مجهول')
         )
         db.session.add(notion)
@@ -462,55 +602,114 @@ def edit_smart_notion(notion_id):
     conversations = ChatConversation.query.filter_by(notion_id=notion_id).order_by(ChatConversation.created_at.asc()).all()
     return render_template('smart_notion_edit.html', notion=notion, conversations=conversations)
 
+def _load_chat_context(notion_id):
+    """Build the Gemini context for a notion chat turn, aborting with 404 if the notion doesn't exist"""
+    # Notion content and its newest conversation id in one SELECT
+    last_conversation_id_query = db.session.query(func.max(ChatConversation.id))\
+        .filter(ChatConversation.notion_id == SmartNotion.id).scalar_subquery()
+    notion_row = db.session.query(SmartNotion.content_html, last_conversation_id_query)\
+        .filter(SmartNotion.id == notion_id).first()
+    if notion_row is None:
+        abort(404)
+    content_html, last_conversation_id = notion_row
+    
+    # Current notion content plus recent conversation history
+    context = f"المحتوى الحالي للملاحظة:\n{content_html}"
+    
+    history = get_chat_history_context(notion_id, last_conversation_id)
+    if history:
+        context = f"{context}\n{history}"
+    return context
+
+def _save_chat_turn(notion_id, user_message, html_content, explanation):
+    """Store the new notion content and the conversation; returns False if the notion is gone"""
+    # Update notion content; rowcount doubles as the existence check
+    updated = db.session.execute(
+        update(SmartNotion)
+        .where(SmartNotion.id == notion_id)
+        .values(content_html=html_content, updated_at=datetime.utcnow())
+    ).rowcount
+    if not updated:
+        db.session.rollback()
+        return False
+    
+    # Save conversation (append-only, so skip the ORM unit of work)
+    db.session.execute(insert(ChatConversation), [{
+        'notion_id': notion_id,
+        'user_message': user_message,
+        'ai_response': explanation
+    }])
+    db.session.commit()
+    return True
+
+def _is_complete_json(text):
+    """Check whether a (possibly fenced) streamed response already parses as JSON"""
+    try:
+        orjson.loads(_RE_FENCE.sub('', text.strip()))
+        return True
+    except orjson.JSONDecodeError:
+        return False
+
+def _sse_event(event, data):
+    """Format a Server-Sent Events message with a JSON payload"""
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
 @app.route('/api/smart_notion/<int:notion_id>/chat', methods=['POST'])
 def smart_notion_chat(notion_id):
-    notion = SmartNotion.query.get_or_404(notion_id)
+    """Apply a chat message to a notion.
+    
+    Responds with JSON by default; clients sending Accept: text/event-stream get
+    the Gemini output streamed as `chunk` events followed by a final `done` event
+    carrying the same payload as the JSON response.
+    """
+    context = _load_chat_context(notion_id)
     user_message = request.json.get('message', '')
     
     if not user_message:
         return jsonify({'error': 'Message is required'}), 400
     
-    # Build context for Gemini
-    context_parts = []
-    
-    # Add current notion content
-    context_parts.append(f"المحتوى الحالي للملاحظة:\n{notion.content_html}")
-    
-    # Add recent conversation history
-    recent_conversations = ChatConversation.query.filter_by(notion_id=notion_id)\
-        .order_by(ChatConversation.created_at.desc()).limit(5).all()
+    wants_stream = request.accept_mimetypes.best_match(
+        ['application/json', 'text/event-stream']) == 'text/event-stream'
     
-    if recent_conversations:
-        context_parts.append("\nتاريخ المحادثة الأخير:")
-        for conv in reversed(recent_conversations):  # Reverse to show chronological order
-            context_parts.append(f"المستخدم: {conv.user_message}")
-            context_parts.append(f"المساعد: {conv.ai_response}")
-    
-    context = "\n".join(context_parts)
-    
-    # Get AI response
-    ai_response = get_gemini_response(user_message, context)
-    html_content, explanation = extract_html_from_response(ai_response)
+    if not wants_stream:
+        # Get AI response
+        ai_response = get_gemini_response(user_message, context)
+        html_content, explanation = extract_html_from_response(ai_response)
+        
+        if html_content and not _save_chat_turn(notion_id, user_message, html_content, explanation):
+            abort(404)
+        
+        return jsonify({
+            'ai_response': explanation,
+            'updated_content': html_content,
+            'success': True
+        })
     
-    if html_content:
-        # Update notion content
-        notion.content_html = html_content
-        notion.updated_at = datetime.utcnow()
+    def generate():
+        chunks = []
+        try:
+            for text in stream_gemini_response(user_message, context):
+                chunks.append(text)
+                yield _sse_event('chunk', {'text': text})
+                # Stop reading as soon as the JSON object is complete
+                tail = text.rstrip()
+                if (tail.endswith('}') or tail.endswith('```')) and _is_complete_json(''.join(chunks)):
+                    break
+            ai_response = ''.join(chunks)
+        except Exception as e:
+            ai_response = _gemini_error_response(e, get_best_gemini_model())
         
-        # Save conversation
-        conversation = ChatConversation(
-            notion_id=notion_id,
-            user_message=user_message,
-            ai_response=explanation
-        )
-        db.session.add(conversation)
-        db.session.commit()
+        html_content, explanation = extract_html_from_response(ai_response)
+        saved = not html_content or _save_chat_turn(notion_id, user_message, html_content, explanation)
+        
+        yield _sse_event('done', {
+            'ai_response': explanation,
+            'updated_content': html_content,
+            'success': saved
+        })
     
-    return jsonify({
-        'ai_response': explanation,
-        'updated_content': html_content,
-        'success': True
-    })
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
 
 @app.route('/api/ai-status')
 def ai_status():
@@ -523,10 +722,9 @@ def ai_status():
         })
     
     # Test connection
-    connection_ok, result = test_gemini_connection()
+    connection_ok, result, best_model = _fetch_models_and_pick()
     
     if connection_ok:
-        best_model = get_best_gemini_model()
         return jsonify({
             'enabled': True,
             'status': 'available',
@@ -557,8 +755,8 @@ def test_gemini():
         
         return jsonify({
             'success': True,
-            'raw_response': test_response[:200] + "..." if len(test_response) > 200 else test_response,
-            'extracted_html': html_content[:200] + "..." if len(html_content) > 200 else html_content,
+            'raw_response': _preview(test_response),
+            'extracted_html': _preview(html_content),
             'explanation': explanation
         })
     except Exception as e:
@@ -569,7 +767,10 @@ def test_gemini():
 
 @app.route('/api/debug-gemini')
 def debug_gemini():
-    """Debug endpoint to show Gemini model and interaction details"""
+    """Debug endpoint to show Gemini model and interaction details.
+    
+    The sample generation is a real Gemini call, so it only runs with ?live=1.
+    """
     if not GEMINI_ENABLED:
         return jsonify({
             'success': False,
@@ -577,10 +778,11 @@ def debug_gemini():
             'model_info': None
         })
     
+    live = request.args.get('live') == '1'
+    
     try:
-        # Get model information
-        best_model = get_best_gemini_model()
-        connection_ok, available_models = test_gemini_connection()
+        # Get model information (cached list_models result)
+        connection_ok, available_models, best_model = _fetch_models_and_pick()
         
         # Test with context example
         sample_context = """المحتوى الحالي للملاحظة:
@@ -595,25 +797,31 @@ def debug_gemini():
         
         sample_request = "أضف قائمة مهام بثلاث مهام"
         
-        # Get sample response
-        sample_response = get_gemini_response(sample_request, sample_context)
-        html_content, explanation = extract_html_from_response(sample_response)
+        context_example = {
+            'user_request': sample_request,
+            'context_used': sample_context
+        }
+        
+        if live:
+            # Get sample response
+            sample_response = get_gemini_response(sample_request, sample_context)
+            html_content, explanation = extract_html_from_response(sample_response)
+            context_example.update({
+                'raw_response': _preview(sample_response, 500),
+                'extracted_html': _preview(html_content, 300),
+                'explanation': explanation
+            })
         
         return jsonify({
             'success': True,
+            'live': live,
             'model_info': {
                 'selected_model': best_model,
                 'connection_status': 'connected' if connection_ok else 'failed',
                 'available_models': available_models[:10] if connection_ok else [],
                 'total_models': len(available_models) if connection_ok else 0
             },
-            'context_example': {
-                'user_request': sample_request,
-                'context_used': sample_context,
-                'raw_response': sample_response[:500] + "..." if len(sample_response) > 500 else sample_response,
-                'extracted_html': html_content[:300] + "..." if len(html_content) > 300 else html_content,
-                'explanation': explanation
-            },
+            'context_example': context_example,
             'prompt_structure': {
                 'system_prompt_includes': [
                     "Arabic language instructions",
@@ -630,7 +838,7 @@ def debug_gemini():
             'success': False,
             'error': str(e),
             'model_info': {
-                'selected_model': get_best_gemini_model() if get_best_gemini_model() else 'unknown',
+                'selected_model': get_best_gemini_model() or 'unknown',
                 'error_details': str(e)
             }
         })
@@ -646,10 +854,9 @@ def get_model_info():
         return jsonify({'enabled': False, 'error': 'API key not configured'})
     
     try:
-        best_model = get_best_gemini_model()
-        connection_ok, available_models = test_gemini_connection()
+        connection_ok, available_models, best_model = _fetch_models_and_pick()
         
-        # Print to console/logs for debugging
+        # Print to console/logs for debugging (reuses the cached model list)
         print_gemini_model_info()
         
         return jsonify({
@@ -658,16 +865,7 @@ def get_model_info():
             'connection_ok': connection_ok,
             'available_models': available_models,
             'total_models': len(available_models) if connection_ok else 0,
-            'preferred_order': [
-                'models/gemini-2.5-flash', 
-                'models/gemini-2.5-pro',
-                'models/gemini-2.5-pro-preview-06-05',
-                'models/gemini-2.0-flash-exp',
-                'models/gemini-1.5-pro',
-                'models/gemini-1.5-flash',
-                'models/gemini-pro',
-                'models/gemini-1.0-pro'
-            ]
+            'preferred_order': list(PREFERRED_GEMINI_MODELS)
         })
     except Exception as e:
         return jsonify({
@@ -679,10 +877,17 @@ def init_db():
     """Initialize database tables"""
     with app.app_context():
         db.create_all()
+        # create_all() skips tables that already exist, so add any missing indexes
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=db.engine, checkfirst=True)
         print("Database tables created successfully!")
 
 if __name__ == '__main__':
-    init_db()
+    # Development server only; production serves app.py through wsgi.py
+    if os.environ.get('INIT_DB', '').lower() in ('1', 'true', 'yes'):
+        init_db()
     port = int(os.environ.get('PORT', 5000))
     host = '0.0.0.0' if port != 5000 else '127.0.0.1'
-    app.run(debug=True, host=host, port=port) 
\ No newline at end of file
+    debug = os.environ.get('FLASK_DEBUG', '').lower() in ('1', 'true', 'yes')
+    app.run(debug=debug, host=host, port=port) 
\ No newline at end of file
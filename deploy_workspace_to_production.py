@@ -23,6 +23,28 @@ import os
 from datetime import datetime
 from werkzeug.security import generate_password_hash
 
+# Bit set in PRAGMA user_version once the workspace deployment has been applied
+# (migrate_production.py uses bit 0x1 of the same counter)
+SCHEMA_FLAG = 0x2
+
+# Data tables that get a workspace_id column
+WORKSPACE_TABLES = (
+    'task', 'resource', 'brainstorm_session', 'idea', 'smart_notion', 'chat_conversation',
+    'voice_note', 'voice_recording', 'voice_comment', 'voice_summary',
+    'monthly_plan', 'monthly_goal', 'reminder',
+    'project', 'phase', 'user_story', 'acceptance_criteria', 'story_note'
+)
+
+# Backfill statements built once, so the text is identical across runs and
+# sqlite3's statement cache can reuse the compiled statements
+WORKSPACE_BACKFILL_SQL = tuple(
+    (table_name, f"UPDATE {table_name} SET workspace_id = 'ws-general' WHERE workspace_id IS NULL OR workspace_id = ''")
+    for table_name in WORKSPACE_TABLES
+)
+
+# Table names in the database, loaded once per run and kept current as tables are created
+EXISTING_TABLES = set()
+
 def get_db_path():
     """Get the database path for production or local environment"""
     # Production database path on Fly.io (mounted volume)
@@ -31,26 +53,54 @@ def get_db_path():
     # Fallback to local instance path
     return 'instance/team_planning.db'
 
-def table_exists(cursor, table_name):
-    """Check if a table exists"""
-    cursor.execute("""
-        SELECT name FROM sqlite_master 
-        WHERE type='table' AND name=?
-    """, (table_name,))
-    return cursor.fetchone() is not None
+def get_schema_version(conn):
+    """Read the migration bits stamped into the database (PRAGMA user_version)"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def tune_sqlite(conn):
+    """Apply bulk-migration PRAGMAs (WAL, relaxed sync, big in-memory cache).
+    
+    WAL is stored in the database file, so the mode it replaces is returned
+    for restore_sqlite() to put back.
+    """
+    cursor = conn.cursor()
+    journal_mode = cursor.execute("PRAGMA journal_mode").fetchone()[0]
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-200000")  # ~200 MB
+    return journal_mode
+
+def restore_sqlite(conn, journal_mode):
+    """Fold the WAL back into the main database file and switch back to the original journal mode"""
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    try:
+        cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+    except sqlite3.OperationalError as e:
+        # Leaving WAL needs the only open connection (e.g. the app is still running)
+        print(f"⚠️  Warning: database left in WAL mode ({e}); switch it back with PRAGMA journal_mode={journal_mode} once the app is stopped")
+
+def load_existing_tables(cursor):
+    """Cache the table names from sqlite_master in EXISTING_TABLES"""
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    EXISTING_TABLES.clear()
+    EXISTING_TABLES.update(row[0] for row in cursor.fetchall())
 
-def column_exists(cursor, table_name, column_name):
-    """Check if a column exists in a table"""
-    cursor.execute(f"PRAGMA table_info({table_name})")
-    columns = [column[1] for column in cursor.fetchall()]
-    return column_name in columns
+def snapshot_schema(cursor):
+    """Read every table's columns once: {table_name: {column_name, ...}}"""
+    schema = {}
+    for table_name in EXISTING_TABLES:
+        cursor.execute(f"PRAGMA table_info({table_name})")
+        schema[table_name] = {column[1] for column in cursor.fetchall()}
+    return schema
 
 def create_user_management_tables(cursor):
     """Create User, Workspace, and UserWorkspace tables"""
     print("\n🔄 Creating User Management tables...")
     
     # User table
-    if not table_exists(cursor, 'user'):
+    if 'user' not in EXISTING_TABLES:
         cursor.execute("""
             CREATE TABLE user (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -62,12 +112,13 @@ def create_user_management_tables(cursor):
                 updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
             )
         """)
+        EXISTING_TABLES.add('user')
         print("  ✅ Created user table")
     else:
         print("  ✅ user table already exists")
     
     # Workspace table
-    if not table_exists(cursor, 'workspace'):
+    if 'workspace' not in EXISTING_TABLES:
         cursor.execute("""
             CREATE TABLE workspace (
                 id VARCHAR(50) PRIMARY KEY,
@@ -77,12 +128,13 @@ def create_user_management_tables(cursor):
                 updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
             )
         """)
+        EXISTING_TABLES.add('workspace')
         print("  ✅ Created workspace table")
     else:
         print("  ✅ workspace table already exists")
     
     # UserWorkspace table
-    if not table_exists(cursor, 'user_workspace'):
+    if 'user_workspace' not in EXISTING_TABLES:
         cursor.execute("""
             CREATE TABLE user_workspace (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -93,6 +145,7 @@ def create_user_management_tables(cursor):
                 FOREIGN KEY (workspace_id) REFERENCES workspace (id)
             )
         """)
+        EXISTING_TABLES.add('user_workspace')
         print("  ✅ Created user_workspace table")
     else:
         print("  ✅ user_workspace table already exists")
@@ -101,118 +154,99 @@ def create_default_workspace_and_admin(cursor, conn):
     """Create the default workspace and admin user"""
     print("\n🔄 Setting up default workspace and admin user...")
     
-    # Create ws-general workspace
-    cursor.execute("SELECT id FROM workspace WHERE id = 'ws-general'")
-    if not cursor.fetchone():
-        cursor.execute("""
-            INSERT INTO workspace (id, name, description, created_at, updated_at)
-            VALUES ('ws-general', 'General Work Space', 'Default workspace for existing data', ?, ?)
-        """, (datetime.now(), datetime.now()))
+    # Timestamps are left to the tables' CURRENT_TIMESTAMP defaults
+    
+    # Create ws-general workspace (primary key makes this a no-op on re-runs)
+    cursor.execute("""
+        INSERT OR IGNORE INTO workspace (id, name, description)
+        VALUES ('ws-general', 'General Work Space', 'Default workspace for existing data')
+    """)
+    if cursor.rowcount:
         print("  ✅ Created 'ws-general' workspace")
     else:
         print("  ✅ 'ws-general' workspace already exists")
     
-    # Create admin user
-    cursor.execute("SELECT id FROM user WHERE username = 'admin'")
+    # Create admin user (username is UNIQUE, so an existing admin is skipped)
+    # The seed password is printed below anyway, so a low work factor loses nothing;
+    # the hash still verifies with check_password_hash and is replaced on password change
+    password_hash = generate_password_hash('admin_@2025', method='pbkdf2:sha256:1000', salt_length=8)
+    cursor.execute("""
+        INSERT OR IGNORE INTO user (username, password_hash, is_superadmin, last_workspace_id)
+        VALUES ('admin', ?, 1, 'ws-general')
+        RETURNING id
+    """, (password_hash,))
     admin_row = cursor.fetchone()
     
-    if not admin_row:
-        password_hash = generate_password_hash('admin_@2025')
-        cursor.execute("""
-            INSERT INTO user (username, password_hash, is_superadmin, last_workspace_id, created_at, updated_at)
-            VALUES ('admin', ?, 1, 'ws-general', ?, ?)
-        """, (password_hash, datetime.now(), datetime.now()))
-        admin_id = cursor.lastrowid
+    if admin_row:
         print("  ✅ Created admin user (username: admin, password: admin_@2025)")
     else:
-        admin_id = admin_row[0]
         # Update to ensure is_superadmin
-        cursor.execute("UPDATE user SET is_superadmin = 1 WHERE id = ?", (admin_id,))
+        cursor.execute("UPDATE user SET is_superadmin = 1 WHERE username = 'admin' RETURNING id")
+        admin_row = cursor.fetchone()
         print("  ✅ Admin user already exists")
+    admin_id = admin_row[0]
     
-    # Assign admin to ws-general
+    # Assign admin to ws-general (user_workspace has no unique pair, so guard inline)
     cursor.execute("""
-        SELECT id FROM user_workspace 
-        WHERE user_id = ? AND workspace_id = 'ws-general'
-    """, (admin_id,))
-    
-    if not cursor.fetchone():
-        cursor.execute("""
-            INSERT INTO user_workspace (user_id, workspace_id, assigned_at)
-            VALUES (?, 'ws-general', ?)
-        """, (admin_id, datetime.now()))
+        INSERT INTO user_workspace (user_id, workspace_id)
+        SELECT ?, 'ws-general'
+        WHERE NOT EXISTS (
+            SELECT 1 FROM user_workspace WHERE user_id = ? AND workspace_id = 'ws-general'
+        )
+    """, (admin_id, admin_id))
+    if cursor.rowcount:
         print("  ✅ Assigned admin to ws-general workspace")
     else:
         print("  ✅ Admin already assigned to ws-general workspace")
-    
-    conn.commit()
 
-def add_workspace_columns(cursor, conn):
+def add_workspace_columns(cursor, conn, schema):
     """Add workspace_id column to all data tables"""
     print("\n🔄 Adding workspace_id columns to existing tables...")
     
-    tables_to_update = [
-        'task', 'resource', 'brainstorm_session', 'idea', 'smart_notion', 'chat_conversation',
-        'voice_note', 'voice_recording', 'voice_comment', 'voice_summary',
-        'monthly_plan', 'monthly_goal', 'reminder',
-        'project', 'phase', 'user_story', 'acceptance_criteria', 'story_note'
-    ]
-    
-    for table_name in tables_to_update:
-        if not table_exists(cursor, table_name):
+    for table_name in WORKSPACE_TABLES:
+        if table_name not in schema:
             print(f"  ⊘ {table_name}: table doesn't exist yet (will be created with schema)")
             continue
         
-        if not column_exists(cursor, table_name, 'workspace_id'):
+        if 'workspace_id' not in schema[table_name]:
             try:
                 cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN workspace_id VARCHAR(50)")
+                schema[table_name].add('workspace_id')
                 print(f"  ✅ Added workspace_id to {table_name}")
             except Exception as e:
-                print(f"  ⚠ Error adding workspace_id to {table_name}: {e}")
+                # Propagate so the whole deployment rolls back instead of being
+                # stamped as applied with this table missing its column
+                print(f"  ❌ Error adding workspace_id to {table_name}: {e}")
+                raise
         else:
             print(f"  ✅ {table_name} already has workspace_id column")
-    
-    conn.commit()
 
-def migrate_data_to_workspace(cursor, conn):
+def migrate_data_to_workspace(cursor, conn, schema):
     """Migrate all existing data to ws-general workspace"""
     print("\n🔄 Migrating existing data to ws-general workspace...")
     
-    tables_to_migrate = [
-        'task', 'resource', 'brainstorm_session', 'idea', 'smart_notion', 'chat_conversation',
-        'voice_note', 'voice_recording', 'voice_comment', 'voice_summary',
-        'monthly_plan', 'monthly_goal', 'reminder',
-        'project', 'phase', 'user_story', 'acceptance_criteria', 'story_note'
-    ]
-    
-    for table_name in tables_to_migrate:
-        if not table_exists(cursor, table_name):
-            continue
-        
-        if not column_exists(cursor, table_name, 'workspace_id'):
+    for table_name, backfill_sql in WORKSPACE_BACKFILL_SQL:
+        if 'workspace_id' not in schema.get(table_name, ()):
             continue
         
         try:
-            # Count records without workspace_id
-            cursor.execute(f"SELECT COUNT(*) FROM {table_name} WHERE workspace_id IS NULL OR workspace_id = ''")
-            count = cursor.fetchone()[0]
-            
-            if count > 0:
-                # Update records to ws-general
-                cursor.execute(f"UPDATE {table_name} SET workspace_id = 'ws-general' WHERE workspace_id IS NULL OR workspace_id = ''")
-                print(f"  ✅ Migrated {count} {table_name} record(s) to ws-general")
+            # Single scan per table: the UPDATE's rowcount replaces the old COUNT(*) probes
+            cursor.execute(backfill_sql)
+            if cursor.rowcount > 0:
+                print(f"  ✅ Migrated {cursor.rowcount} {table_name} record(s) to ws-general")
             else:
-                # Check total records
-                cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-                total = cursor.fetchone()[0]
-                if total > 0:
-                    print(f"  ✅ {table_name}: All {total} records already have workspace_id")
-                else:
-                    print(f"  ⊘ {table_name}: No records to migrate")
+                print(f"  ✅ {table_name}: Nothing to migrate")
         except Exception as e:
-            print(f"  ⚠ Error migrating {table_name}: {e}")
+            print(f"  ❌ Error migrating {table_name}: {e}")
+            raise
     
-    conn.commit()
+    # Index workspace_id only now that the bulk UPDATE is done, so each index is
+    # built in one sequential pass instead of being rewritten row by row
+    for table_name in WORKSPACE_TABLES:
+        if 'workspace_id' not in schema.get(table_name, ()):
+            continue
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_workspace ON {table_name}(workspace_id)")
+    print("  ✅ Indexed workspace_id on migrated tables")
 
 def deploy_to_production():
     """Main deployment function"""
@@ -226,11 +260,23 @@ def deploy_to_production():
         print("   Please run the app first to create the database, then run this script.")
         return False
     
-    # Create backup
+    # Connect first so the backup below goes through SQLite's online backup API
+    conn = sqlite3.connect(db_path)
+    
+    # Fast path: re-runs (e.g. after a Fly.io restart) skip all schema probing
+    if get_schema_version(conn) & SCHEMA_FLAG:
+        print("✅ Database already deployed, nothing to do")
+        conn.close()
+        return True
+    
+    # Create backup (page-level copy that respects WAL/locks, unlike a raw file copy)
     backup_path = f"{db_path}.backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
     try:
-        import shutil
-        shutil.copy2(db_path, backup_path)
+        backup_conn = sqlite3.connect(backup_path)
+        try:
+            conn.backup(backup_conn, pages=1024)
+        finally:
+            backup_conn.close()
         print(f"📋 Created backup: {backup_path}")
     except Exception as e:
         print(f"⚠️  Warning: Could not create backup: {e}")
@@ -240,25 +286,37 @@ def deploy_to_production():
     print("🚀 STARTING WORKSPACE & USER MANAGEMENT DEPLOYMENT")
     print("="*80)
     
+    journal_mode = None
     try:
-        # Connect to database
-        conn = sqlite3.connect(db_path)
+        # Manage the transaction ourselves: SQLite DDL is transactional, so every
+        # CREATE/ALTER/UPDATE below lands in a single BEGIN ... COMMIT (one fsync)
+        conn.isolation_level = None
+        journal_mode = tune_sqlite(conn)
         cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        load_existing_tables(cursor)
         
         # Step 1: Create user management tables
         create_user_management_tables(cursor)
+        # Refresh so SQLite's own tables (e.g. sqlite_sequence) are picked up too
+        load_existing_tables(cursor)
         
         # Step 2: Create default workspace and admin user
         create_default_workspace_and_admin(cursor, conn)
         
+        # Read the schema once instead of probing each table/column separately
+        schema = snapshot_schema(cursor)
+        
         # Step 3: Add workspace_id columns to existing tables
-        add_workspace_columns(cursor, conn)
+        add_workspace_columns(cursor, conn, schema)
         
         # Step 4: Migrate existing data to ws-general workspace
-        migrate_data_to_workspace(cursor, conn)
+        migrate_data_to_workspace(cursor, conn, schema)
         
-        # Commit all changes
-        conn.commit()
+        # Set this script's bit (keeping the other script's) and commit all changes
+        cursor.execute(f"PRAGMA user_version = {get_schema_version(conn) | SCHEMA_FLAG}")
+        cursor.execute("COMMIT")
+        restore_sqlite(conn, journal_mode)
         
         print("\n" + "="*80)
         print("🎉 DEPLOYMENT COMPLETED SUCCESSFULLY!")
@@ -275,16 +333,16 @@ def deploy_to_production():
         print("\n📊 Database schema summary:")
         
         # Show table information
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
-        tables = cursor.fetchall()
-        print(f"\n   Total tables: {len(tables)}")
+        print(f"\n   Total tables: {len(EXISTING_TABLES)}")
         
-        # Count records in key tables
+        # Count records in key tables with a single UNION ALL query
         key_tables = ['user', 'workspace', 'user_workspace', 'task', 'resource', 'project', 'user_story']
-        for table_name in key_tables:
-            if any(t[0] == table_name for t in tables):
-                cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-                count = cursor.fetchone()[0]
+        present_tables = [t for t in key_tables if t in EXISTING_TABLES]
+        if present_tables:
+            cursor.execute(" UNION ALL ".join(
+                f"SELECT '{t}', COUNT(*) FROM {t}" for t in present_tables
+            ))
+            for table_name, count in cursor.fetchall():
                 print(f"   📋 {table_name}: {count} records")
         
         conn.close()
@@ -303,9 +361,11 @@ def deploy_to_production():
         
     except Exception as e:
         print(f"\n❌ Deployment failed: {str(e)}")
-        if 'conn' in locals():
-            conn.rollback()
-            conn.close()
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        if journal_mode is not None:
+            restore_sqlite(conn, journal_mode)
+        conn.close()
         print(f"\nBackup is available at: {backup_path}")
         return False
 
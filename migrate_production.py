@@ -8,6 +8,45 @@ import sqlite3
 import os
 from datetime import datetime
 
+# Bit set in PRAGMA user_version once the production migration has been applied.
+# deploy_workspace_to_production.py owns a different bit of the same counter, so
+# either script can run first without making the other one skip
+SCHEMA_FLAG = 0x1
+
+# Rows copied per statement when the reminder table has to be rebuilt
+REMINDER_COPY_BATCH_SIZE = 1000
+
+# Columns added to existing tables: {table: ([(column, type), ...], backfill SQL or None)}.
+# The backfill runs once, only when at least one column was added.
+SCHEMA_DELTAS = {
+    # Task enhancements; updated_at and completed_at are backfilled in one pass
+    # (SET expressions see the old row, hence COALESCE for both)
+    'task': ([
+        ('tags', 'VARCHAR(500)'),
+        ('updated_at', 'DATETIME'),
+        ('completed_at', 'DATETIME')
+    ], """
+        UPDATE task
+        SET updated_at = COALESCE(updated_at, created_at),
+            completed_at = CASE
+                WHEN status = 'completed' AND completed_at IS NULL
+                THEN COALESCE(updated_at, created_at)
+                ELSE completed_at
+            END
+        WHERE updated_at IS NULL OR (status = 'completed' AND completed_at IS NULL)
+    """),
+    # File upload support
+    'resource': ([
+        ('filename', 'VARCHAR(255)'),
+        ('file_size', 'INTEGER'),
+        ('updated_at', 'DATETIME')
+    ], "UPDATE resource SET updated_at = created_at WHERE updated_at IS NULL"),
+    # Soft delete
+    'smart_notion': ([
+        ('deleted_at', 'DATETIME')
+    ], None),
+}
+
 def get_db_path():
     """Get the database path for production or local environment"""
     # Production database path on Fly.io
@@ -16,249 +55,198 @@ def get_db_path():
     # Fallback to local instance path
     return 'instance/team_planning.db'
 
-def table_exists(cursor, table_name):
-    """Check if a table exists"""
-    cursor.execute("""
-        SELECT name FROM sqlite_master 
-        WHERE type='table' AND name=?
-    """, (table_name,))
-    return cursor.fetchone() is not None
+def get_schema_version(conn):
+    """Read the migration bits stamped into the database (PRAGMA user_version)"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
 
-def column_exists(cursor, table_name, column_name):
-    """Check if a column exists in a table"""
-    cursor.execute(f"PRAGMA table_info({table_name})")
-    columns = [column[1] for column in cursor.fetchall()]
-    return column_name in columns
+def tune_sqlite(conn):
+    """Apply bulk-migration PRAGMAs (WAL, relaxed sync, big in-memory cache, mmap reads).
+    
+    Returns the database's previous journal mode for restore_sqlite(); the other
+    settings only last as long as this connection.
+    """
+    cursor = conn.cursor()
+    journal_mode = cursor.execute("PRAGMA journal_mode").fetchone()[0]
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-200000")  # ~200 MB
+    cursor.execute("PRAGMA mmap_size=268435456")  # 256 MB
+    # No per-row FK enforcement while backfilling; checked once at the end instead
+    cursor.execute("PRAGMA foreign_keys=OFF")
+    return journal_mode
 
-def migrate_task_table(cursor):
-    """Migrate Task table with new enhancements"""
-    print("🔄 Migrating Task table...")
-    
-    if not table_exists(cursor, 'task'):
-        print("⚠️  Task table doesn't exist, will be created with new schema")
-        return
-    
-    # Add new columns if they don't exist
-    task_columns = [
-        ('tags', 'VARCHAR(500)'),
-        ('updated_at', 'DATETIME'),
-        ('completed_at', 'DATETIME')
-    ]
-    
-    migration_needed = False
-    
-    for column_name, column_type in task_columns:
-        if not column_exists(cursor, 'task', column_name):
-            print(f"  ➕ Adding column: {column_name}")
-            migration_needed = True
-            
-            cursor.execute(f"ALTER TABLE task ADD COLUMN {column_name} {column_type}")
-            
-            # Set default values for existing records
-            if column_name == 'updated_at':
-                cursor.execute("UPDATE task SET updated_at = created_at WHERE updated_at IS NULL")
-        else:
-            print(f"  ✅ Column {column_name} already exists")
-    
-    if migration_needed:
-        # Update completed_at for tasks that are already completed
-        cursor.execute("""
-            UPDATE task 
-            SET completed_at = updated_at 
-            WHERE status = 'completed' AND completed_at IS NULL
-        """)
-        print("  ✅ Task table migration completed")
-    else:
-        print("  ✅ Task table already up to date")
+def restore_sqlite(conn, journal_mode):
+    """Fold the WAL back into the main database file and switch back to the original journal mode"""
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    try:
+        cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+    except sqlite3.OperationalError as e:
+        # Leaving WAL needs the only open connection (e.g. the app is still running)
+        print(f"⚠️  Warning: database left in WAL mode ({e}); switch it back with PRAGMA journal_mode={journal_mode} once the app is stopped")
 
-def migrate_resource_table(cursor):
-    """Migrate Resource table with file upload support"""
-    print("🔄 Migrating Resource table...")
+def load_schema(cursor):
+    """Read every table and its columns with one catalog query: {table_name: {column_name, ...}}"""
+    cursor.execute("""
+        SELECT m.name, p.name
+        FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p
+        WHERE m.type = 'table'
+    """)
+    schema = {}
+    for table_name, column_name in cursor.fetchall():
+        schema.setdefault(table_name, set()).add(column_name)
+    return schema
+
+def add_columns(cursor, schema, table_name, columns, backfill_sql=None):
+    """Add any missing columns to an existing table, then run its backfill once"""
+    print(f"🔄 Migrating {table_name} table...")
     
-    if not table_exists(cursor, 'resource'):
-        print("⚠️  Resource table doesn't exist, will be created with new schema")
+    if table_name not in schema:
+        print(f"⚠️  {table_name} table doesn't exist, will be created with new schema")
         return
     
-    # Add new columns if they don't exist
-    resource_columns = [
-        ('filename', 'VARCHAR(255)'),
-        ('file_size', 'INTEGER'),
-        ('updated_at', 'DATETIME')
-    ]
-    
-    migration_needed = False
+    # Work out everything that's missing from the cached schema in one go
+    missing = [(name, sql_type) for name, sql_type in columns
+               if name not in schema[table_name]]
+    if not missing:
+        print(f"  ✅ {table_name} table already up to date")
+        return
     
-    for column_name, column_type in resource_columns:
-        if not column_exists(cursor, 'resource', column_name):
-            print(f"  ➕ Adding column: {column_name}")
-            migration_needed = True
-            
-            cursor.execute(f"ALTER TABLE resource ADD COLUMN {column_name} {column_type}")
-            
-            # Set default values for existing records
-            if column_name == 'updated_at':
-                cursor.execute("UPDATE resource SET updated_at = created_at WHERE updated_at IS NULL")
-        else:
-            print(f"  ✅ Column {column_name} already exists")
+    for column_name, column_type in missing:
+        print(f"  ➕ Adding column: {column_name}")
+        cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}")
+        schema[table_name].add(column_name)
     
-    if migration_needed:
-        print("  ✅ Resource table migration completed")
-    else:
-        print("  ✅ Resource table already up to date")
+    # Set default values for existing records
+    if backfill_sql:
+        cursor.execute(backfill_sql)
+    print(f"  ✅ {table_name} table migration completed")
 
-def migrate_smart_notion_table(cursor):
-    """Add soft delete support to SmartNotion table"""
-    print("🔄 Migrating SmartNotion table...")
-    
-    if not table_exists(cursor, 'smart_notion'):
-        print("⚠️  SmartNotion table doesn't exist, will be created with new schema")
+def create_table(cursor, schema, table_name, create_sql):
+    """Run a CREATE TABLE IF NOT EXISTS unless the schema snapshot already has the table"""
+    # The snapshot is authoritative for this run, so existing tables cost no SQL at all
+    if table_name in schema:
+        print(f"  ✅ {table_name} table already exists")
         return
-    
-    if not column_exists(cursor, 'smart_notion', 'deleted_at'):
-        print("  ➕ Adding deleted_at column for soft delete")
-        cursor.execute("ALTER TABLE smart_notion ADD COLUMN deleted_at DATETIME")
-        print("  ✅ SmartNotion soft delete migration completed")
-    else:
-        print("  ✅ SmartNotion table already up to date")
+    cursor.execute(create_sql)
+    schema[table_name] = set()
+    print(f"  ✅ Created {table_name} table")
 
-def create_voice_notes_tables(cursor):
+def create_voice_notes_tables(cursor, schema):
     """Create all voice notes related tables"""
     print("🔄 Creating Voice Notes tables...")
     
     # Voice Note table
-    if not table_exists(cursor, 'voice_note'):
-        cursor.execute("""
-            CREATE TABLE voice_note (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title VARCHAR(200) NOT NULL,
-                description TEXT,
-                summary_html TEXT,
-                created_by VARCHAR(100),
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                deleted_at DATETIME
-            )
-        """)
-        print("  ✅ Created voice_note table")
-    else:
-        print("  ✅ voice_note table already exists")
+    create_table(cursor, schema, 'voice_note', """
+        CREATE TABLE IF NOT EXISTS voice_note (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title VARCHAR(200) NOT NULL,
+            description TEXT,
+            summary_html TEXT,
+            created_by VARCHAR(100),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            deleted_at DATETIME
+        )
+    """)
     
     # Voice Recording table
-    if not table_exists(cursor, 'voice_recording'):
-        cursor.execute("""
-            CREATE TABLE voice_recording (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                voice_note_id INTEGER NOT NULL,
-                filename VARCHAR(255) NOT NULL,
-                original_name VARCHAR(255),
-                file_size INTEGER,
-                duration INTEGER,
-                content_type VARCHAR(50) DEFAULT 'audio/webm',
-                transcription TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (voice_note_id) REFERENCES voice_note (id)
-            )
-        """)
-        print("  ✅ Created voice_recording table")
-    else:
-        print("  ✅ voice_recording table already exists")
+    create_table(cursor, schema, 'voice_recording', """
+        CREATE TABLE IF NOT EXISTS voice_recording (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            voice_note_id INTEGER NOT NULL,
+            filename VARCHAR(255) NOT NULL,
+            original_name VARCHAR(255),
+            file_size INTEGER,
+            duration INTEGER,
+            content_type VARCHAR(50) DEFAULT 'audio/webm',
+            transcription TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (voice_note_id) REFERENCES voice_note (id)
+        )
+    """)
     
     # Voice Comment table
-    if not table_exists(cursor, 'voice_comment'):
-        cursor.execute("""
-            CREATE TABLE voice_comment (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                voice_note_id INTEGER NOT NULL,
-                content TEXT NOT NULL,
-                author VARCHAR(100),
-                comment_type VARCHAR(20) DEFAULT 'text',
-                recording_id INTEGER,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (voice_note_id) REFERENCES voice_note (id),
-                FOREIGN KEY (recording_id) REFERENCES voice_recording (id)
-            )
-        """)
-        print("  ✅ Created voice_comment table")
-    else:
-        print("  ✅ voice_comment table already exists")
+    create_table(cursor, schema, 'voice_comment', """
+        CREATE TABLE IF NOT EXISTS voice_comment (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            voice_note_id INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            author VARCHAR(100),
+            comment_type VARCHAR(20) DEFAULT 'text',
+            recording_id INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (voice_note_id) REFERENCES voice_note (id),
+            FOREIGN KEY (recording_id) REFERENCES voice_recording (id)
+        )
+    """)
     
     # Voice Summary table
-    if not table_exists(cursor, 'voice_summary'):
-        cursor.execute("""
-            CREATE TABLE voice_summary (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                voice_note_id INTEGER NOT NULL,
-                summary_html TEXT NOT NULL,
-                summary_version INTEGER DEFAULT 1,
-                transcripts_count INTEGER DEFAULT 0,
-                comments_count INTEGER DEFAULT 0,
-                model_used VARCHAR(100),
-                created_by VARCHAR(100),
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                is_current BOOLEAN DEFAULT 1,
-                FOREIGN KEY (voice_note_id) REFERENCES voice_note (id)
-            )
-        """)
-        print("  ✅ Created voice_summary table")
-    else:
-        print("  ✅ voice_summary table already exists")
+    create_table(cursor, schema, 'voice_summary', """
+        CREATE TABLE IF NOT EXISTS voice_summary (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            voice_note_id INTEGER NOT NULL,
+            summary_html TEXT NOT NULL,
+            summary_version INTEGER DEFAULT 1,
+            transcripts_count INTEGER DEFAULT 0,
+            comments_count INTEGER DEFAULT 0,
+            model_used VARCHAR(100),
+            created_by VARCHAR(100),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            is_current BOOLEAN DEFAULT 1,
+            FOREIGN KEY (voice_note_id) REFERENCES voice_note (id)
+        )
+    """)
 
-def create_monthly_planning_tables(cursor):
+def create_monthly_planning_tables(cursor, schema):
     """Create monthly planning related tables"""
     print("🔄 Creating Monthly Planning tables...")
     
     # Monthly Plan table
-    if not table_exists(cursor, 'monthly_plan'):
-        cursor.execute("""
-            CREATE TABLE monthly_plan (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title VARCHAR(200) NOT NULL,
-                month INTEGER NOT NULL,
-                year INTEGER NOT NULL,
-                status VARCHAR(20) DEFAULT 'active',
-                priority VARCHAR(10) DEFAULT 'medium',
-                category VARCHAR(50) DEFAULT 'general',
-                tags VARCHAR(500),
-                progress_percentage INTEGER DEFAULT 0,
-                created_by VARCHAR(100),
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                completed_at DATETIME,
-                deleted_at DATETIME
-            )
-        """)
-        print("  ✅ Created monthly_plan table")
-    else:
-        print("  ✅ monthly_plan table already exists")
+    create_table(cursor, schema, 'monthly_plan', """
+        CREATE TABLE IF NOT EXISTS monthly_plan (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title VARCHAR(200) NOT NULL,
+            month INTEGER NOT NULL,
+            year INTEGER NOT NULL,
+            status VARCHAR(20) DEFAULT 'active',
+            priority VARCHAR(10) DEFAULT 'medium',
+            category VARCHAR(50) DEFAULT 'general',
+            tags VARCHAR(500),
+            progress_percentage INTEGER DEFAULT 0,
+            created_by VARCHAR(100),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            completed_at DATETIME,
+            deleted_at DATETIME
+        )
+    """)
     
     # Monthly Goal table
-    if not table_exists(cursor, 'monthly_goal'):
-        cursor.execute("""
-            CREATE TABLE monthly_goal (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                monthly_plan_id INTEGER NOT NULL,
-                title VARCHAR(200) NOT NULL,
-                target_date DATE,
-                status VARCHAR(20) DEFAULT 'pending',
-                priority VARCHAR(10) DEFAULT 'medium',
-                order_index INTEGER DEFAULT 0,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                completed_at DATETIME,
-                FOREIGN KEY (monthly_plan_id) REFERENCES monthly_plan (id)
-            )
-        """)
-        print("  ✅ Created monthly_goal table")
-    else:
-        print("  ✅ monthly_goal table already exists")
+    create_table(cursor, schema, 'monthly_goal', """
+        CREATE TABLE IF NOT EXISTS monthly_goal (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            monthly_plan_id INTEGER NOT NULL,
+            title VARCHAR(200) NOT NULL,
+            target_date DATE,
+            status VARCHAR(20) DEFAULT 'pending',
+            priority VARCHAR(10) DEFAULT 'medium',
+            order_index INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            completed_at DATETIME,
+            FOREIGN KEY (monthly_plan_id) REFERENCES monthly_plan (id)
+        )
+    """)
 
-def create_reminder_table(cursor):
+def create_reminder_table(cursor, schema):
     """Create reminder table"""
     print("🔄 Creating Reminder table...")
     
-    if not table_exists(cursor, 'reminder'):
+    if 'reminder' not in schema:
         cursor.execute("""
-            CREATE TABLE reminder (
+            CREATE TABLE IF NOT EXISTS reminder (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 title VARCHAR(200) NOT NULL,
                 reminder_date DATE,
@@ -273,211 +261,228 @@ def create_reminder_table(cursor):
                 deleted_at DATETIME
             )
         """)
+        schema['reminder'] = set()
         print("  ✅ Created reminder table")
     else:
         print("  ✅ reminder table already exists")
         
         # Handle metadata column rename to extra_info to avoid SQLAlchemy conflict
-        if column_exists(cursor, 'reminder', 'metadata'):
+        if 'metadata' in schema['reminder']:
             print("  🔄 Renaming metadata column to extra_info to avoid SQLAlchemy conflict")
-            # SQLite doesn't support column rename directly, so we need to recreate the table
-            cursor.execute("""
-                CREATE TABLE reminder_new (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    title VARCHAR(200) NOT NULL,
-                    reminder_date DATE,
-                    priority VARCHAR(10) DEFAULT 'medium',
-                    status VARCHAR(20) DEFAULT 'active',
-                    category VARCHAR(50) DEFAULT 'general',
-                    extra_info TEXT,
-                    created_by VARCHAR(100),
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    completed_at DATETIME,
-                    deleted_at DATETIME
-                )
-            """)
+            if (sqlite3.sqlite_version_info >= (3, 25, 0)
+                    and 'extra_info' not in schema['reminder']):
+                # SQLite 3.25+ renames in place: a catalog update, no row copy
+                cursor.execute("ALTER TABLE reminder RENAME COLUMN metadata TO extra_info")
+            elif sqlite3.sqlite_version_info >= (3, 35, 0):
+                # Both columns exist (half-applied rename): backfill extra_info from
+                # metadata without overwriting newer values, then drop the old column
+                cursor.execute("UPDATE reminder SET extra_info = metadata WHERE extra_info IS NULL")
+                cursor.execute("ALTER TABLE reminder DROP COLUMN metadata")
+            else:
+                # Older SQLite can't rename or drop a column, so we need to recreate the table
+                cursor.execute("""
+                    CREATE TABLE reminder_new (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        title VARCHAR(200) NOT NULL,
+                        reminder_date DATE,
+                        priority VARCHAR(10) DEFAULT 'medium',
+                        status VARCHAR(20) DEFAULT 'active',
+                        category VARCHAR(50) DEFAULT 'general',
+                        extra_info TEXT,
+                        created_by VARCHAR(100),
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                        completed_at DATETIME,
+                        deleted_at DATETIME
+                    )
+                """)
             
-            # Copy data from old table to new table
-            cursor.execute("""
-                INSERT INTO reminder_new (id, title, reminder_date, priority, status, category, extra_info, created_by, created_at, updated_at, completed_at, deleted_at)
-                SELECT id, title, reminder_date, priority, status, category, metadata, created_by, created_at, updated_at, completed_at, deleted_at
-                FROM reminder
-            """)
+                # Copy data from old table to new table in id-ordered batches, so the
+                # WAL grows a batch at a time and progress is visible on big tables
+                cursor.execute("SELECT COUNT(*) FROM reminder")
+                total = cursor.fetchone()[0]
+                copied, last_id = 0, 0
+                while copied < total:
+                    cursor.execute("""
+                        INSERT INTO reminder_new (id, title, reminder_date, priority, status, category, extra_info, created_by, created_at, updated_at, completed_at, deleted_at)
+                        SELECT id, title, reminder_date, priority, status, category, metadata, created_by, created_at, updated_at, completed_at, deleted_at
+                        FROM reminder WHERE id > ? ORDER BY id LIMIT ?
+                    """, (last_id, REMINDER_COPY_BATCH_SIZE))
+                    if cursor.rowcount <= 0:
+                        break
+                    copied += cursor.rowcount
+                    last_id = cursor.lastrowid
+                    print(f"  ↪ Copied {copied}/{total} reminder rows")
             
-            # Drop old table and rename new table
-            cursor.execute("DROP TABLE reminder")
-            cursor.execute("ALTER TABLE reminder_new RENAME TO reminder")
+                # Drop old table and rename new table
+                cursor.execute("DROP TABLE reminder")
+                cursor.execute("ALTER TABLE reminder_new RENAME TO reminder")
+            schema['reminder'].discard('metadata')
+            schema['reminder'].add('extra_info')
             print("  ✅ Successfully renamed metadata column to extra_info")
-        elif not column_exists(cursor, 'reminder', 'extra_info'):
+        elif 'extra_info' not in schema['reminder']:
             print("  ➕ Adding extra_info column to reminder table")
             cursor.execute("ALTER TABLE reminder ADD COLUMN extra_info TEXT")
+            schema['reminder'].add('extra_info')
             print("  ✅ Added extra_info column to reminder table")
 
-def create_chat_conversation_table(cursor):
+def create_chat_conversation_table(cursor, schema):
     """Create chat conversation table"""
     print("🔄 Creating Chat Conversation table...")
     
-    if not table_exists(cursor, 'chat_conversation'):
-        cursor.execute("""
-            CREATE TABLE chat_conversation (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                notion_id INTEGER NOT NULL,
-                user_message TEXT NOT NULL,
-                ai_response TEXT NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (notion_id) REFERENCES smart_notion (id)
-            )
-        """)
-        print("  ✅ Created chat_conversation table")
-    else:
-        print("  ✅ chat_conversation table already exists")
+    create_table(cursor, schema, 'chat_conversation', """
+        CREATE TABLE IF NOT EXISTS chat_conversation (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            notion_id INTEGER NOT NULL,
+            user_message TEXT NOT NULL,
+            ai_response TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (notion_id) REFERENCES smart_notion (id)
+        )
+    """)
 
-def create_backlog_tables(cursor):
+def create_backlog_tables(cursor, schema):
     """Create backlog management tables for development workflow"""
     print("🔄 Creating Backlog Management tables...")
     
     # Project table
-    if not table_exists(cursor, 'project'):
-        cursor.execute("""
-            CREATE TABLE project (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name VARCHAR(200) NOT NULL,
-                name_arabic VARCHAR(200) DEFAULT '',
-                description TEXT,
-                status VARCHAR(20) DEFAULT 'active',
-                priority VARCHAR(10) DEFAULT 'medium',
-                start_date DATE,
-                end_date DATE,
-                created_by VARCHAR(100),
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                deleted_at DATETIME,
-                order_index INTEGER DEFAULT 0
-            )
-        """)
-        print("  ✅ Created project table")
-    else:
-        print("  ✅ project table already exists")
+    create_table(cursor, schema, 'project', """
+        CREATE TABLE IF NOT EXISTS project (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name VARCHAR(200) NOT NULL,
+            name_arabic VARCHAR(200) DEFAULT '',
+            description TEXT,
+            status VARCHAR(20) DEFAULT 'active',
+            priority VARCHAR(10) DEFAULT 'medium',
+            start_date DATE,
+            end_date DATE,
+            created_by VARCHAR(100),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            deleted_at DATETIME,
+            order_index INTEGER DEFAULT 0
+        )
+    """)
     
     # Phase table
-    if not table_exists(cursor, 'phase'):
-        cursor.execute("""
-            CREATE TABLE phase (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                project_id INTEGER NOT NULL,
-                name VARCHAR(200) NOT NULL,
-                name_arabic VARCHAR(200) DEFAULT '',
-                description TEXT,
-                duration_weeks INTEGER,
-                goal TEXT,
-                status VARCHAR(20) DEFAULT 'pending',
-                order_index INTEGER DEFAULT 0,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (project_id) REFERENCES project (id) ON DELETE CASCADE
-            )
-        """)
-        print("  ✅ Created phase table")
-    else:
-        print("  ✅ phase table already exists")
+    create_table(cursor, schema, 'phase', """
+        CREATE TABLE IF NOT EXISTS phase (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER NOT NULL,
+            name VARCHAR(200) NOT NULL,
+            name_arabic VARCHAR(200) DEFAULT '',
+            description TEXT,
+            duration_weeks INTEGER,
+            goal TEXT,
+            status VARCHAR(20) DEFAULT 'pending',
+            order_index INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (project_id) REFERENCES project (id) ON DELETE CASCADE
+        )
+    """)
     
     # UserStory table
-    if not table_exists(cursor, 'user_story'):
-        cursor.execute("""
-            CREATE TABLE user_story (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                phase_id INTEGER NOT NULL,
-                story_id VARCHAR(20) NOT NULL,
-                title VARCHAR(300) NOT NULL,
-                title_arabic VARCHAR(300),
-                user_role VARCHAR(100),
-                user_goal TEXT,
-                user_benefit TEXT,
-                description TEXT,
-                priority VARCHAR(10) DEFAULT 'medium',
-                complexity VARCHAR(10) DEFAULT 'medium',
-                status VARCHAR(20) DEFAULT 'pending',
-                technical_notes TEXT,
-                order_index INTEGER DEFAULT 0,
-                completed_at DATETIME,
-                created_by VARCHAR(100),
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (phase_id) REFERENCES phase (id) ON DELETE CASCADE
-            )
-        """)
-        print("  ✅ Created user_story table")
-    else:
-        print("  ✅ user_story table already exists")
+    create_table(cursor, schema, 'user_story', """
+        CREATE TABLE IF NOT EXISTS user_story (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            phase_id INTEGER NOT NULL,
+            story_id VARCHAR(20) NOT NULL,
+            title VARCHAR(300) NOT NULL,
+            title_arabic VARCHAR(300),
+            user_role VARCHAR(100),
+            user_goal TEXT,
+            user_benefit TEXT,
+            description TEXT,
+            priority VARCHAR(10) DEFAULT 'medium',
+            complexity VARCHAR(10) DEFAULT 'medium',
+            status VARCHAR(20) DEFAULT 'pending',
+            technical_notes TEXT,
+            order_index INTEGER DEFAULT 0,
+            completed_at DATETIME,
+            created_by VARCHAR(100),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (phase_id) REFERENCES phase (id) ON DELETE CASCADE
+        )
+    """)
     
     # AcceptanceCriteria table
-    if not table_exists(cursor, 'acceptance_criteria'):
-        cursor.execute("""
-            CREATE TABLE acceptance_criteria (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_story_id INTEGER NOT NULL,
-                description TEXT NOT NULL,
-                description_arabic TEXT,
-                is_completed BOOLEAN DEFAULT 0,
-                order_index INTEGER DEFAULT 0,
-                completed_at DATETIME,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_story_id) REFERENCES user_story (id) ON DELETE CASCADE
-            )
-        """)
-        print("  ✅ Created acceptance_criteria table")
-    else:
-        print("  ✅ acceptance_criteria table already exists")
+    create_table(cursor, schema, 'acceptance_criteria', """
+        CREATE TABLE IF NOT EXISTS acceptance_criteria (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_story_id INTEGER NOT NULL,
+            description TEXT NOT NULL,
+            description_arabic TEXT,
+            is_completed BOOLEAN DEFAULT 0,
+            order_index INTEGER DEFAULT 0,
+            completed_at DATETIME,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_story_id) REFERENCES user_story (id) ON DELETE CASCADE
+        )
+    """)
     
     # StoryNote table
-    if not table_exists(cursor, 'story_note'):
-        cursor.execute("""
-            CREATE TABLE story_note (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_story_id INTEGER NOT NULL,
-                content TEXT NOT NULL,
-                note_type VARCHAR(20) DEFAULT 'general',
-                author VARCHAR(100),
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_story_id) REFERENCES user_story (id) ON DELETE CASCADE
-            )
-        """)
-        print("  ✅ Created story_note table")
-    else:
-        print("  ✅ story_note table already exists")
+    create_table(cursor, schema, 'story_note', """
+        CREATE TABLE IF NOT EXISTS story_note (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_story_id INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            note_type VARCHAR(20) DEFAULT 'general',
+            author VARCHAR(100),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_story_id) REFERENCES user_story (id) ON DELETE CASCADE
+        )
+    """)
 
-def create_indexes(cursor):
+def create_indexes(cursor, schema):
     """Create performance indexes"""
     print("🔄 Creating performance indexes...")
     
     indexes = [
-        ("idx_voice_note_deleted", "CREATE INDEX IF NOT EXISTS idx_voice_note_deleted ON voice_note(deleted_at)"),
-        ("idx_voice_recording_note", "CREATE INDEX IF NOT EXISTS idx_voice_recording_note ON voice_recording(voice_note_id)"),
-        ("idx_voice_comment_note", "CREATE INDEX IF NOT EXISTS idx_voice_comment_note ON voice_comment(voice_note_id)"),
-        ("idx_voice_summary_note", "CREATE INDEX IF NOT EXISTS idx_voice_summary_note ON voice_summary(voice_note_id)"),
-        ("idx_voice_summary_current", "CREATE INDEX IF NOT EXISTS idx_voice_summary_current ON voice_summary(is_current)"),
-        ("idx_smart_notion_deleted", "CREATE INDEX IF NOT EXISTS idx_smart_notion_deleted ON smart_notion(deleted_at)"),
-        ("idx_monthly_plan_date", "CREATE INDEX IF NOT EXISTS idx_monthly_plan_date ON monthly_plan(year, month)"),
-        ("idx_monthly_goal_plan", "CREATE INDEX IF NOT EXISTS idx_monthly_goal_plan ON monthly_goal(monthly_plan_id)"),
-        ("idx_reminder_date", "CREATE INDEX IF NOT EXISTS idx_reminder_date ON reminder(reminder_date)"),
-        ("idx_chat_conversation_notion", "CREATE INDEX IF NOT EXISTS idx_chat_conversation_notion ON chat_conversation(notion_id)"),
-        ("idx_phase_project", "CREATE INDEX IF NOT EXISTS idx_phase_project ON phase(project_id)"),
-        ("idx_story_phase", "CREATE INDEX IF NOT EXISTS idx_story_phase ON user_story(phase_id)"),
-        ("idx_story_status", "CREATE INDEX IF NOT EXISTS idx_story_status ON user_story(status)"),
-        ("idx_criteria_story", "CREATE INDEX IF NOT EXISTS idx_criteria_story ON acceptance_criteria(user_story_id)"),
-        ("idx_note_story", "CREATE INDEX IF NOT EXISTS idx_note_story ON story_note(user_story_id)"),
-        ("idx_project_status", "CREATE INDEX IF NOT EXISTS idx_project_status ON project(status)")
+        ("voice_note", "CREATE INDEX IF NOT EXISTS idx_voice_note_deleted ON voice_note(deleted_at)"),
+        ("voice_recording", "CREATE INDEX IF NOT EXISTS idx_voice_recording_note ON voice_recording(voice_note_id)"),
+        ("voice_comment", "CREATE INDEX IF NOT EXISTS idx_voice_comment_note ON voice_comment(voice_note_id)"),
+        ("voice_summary", "CREATE INDEX IF NOT EXISTS idx_voice_summary_note ON voice_summary(voice_note_id)"),
+        ("voice_summary", "CREATE INDEX IF NOT EXISTS idx_voice_summary_current ON voice_summary(is_current)"),
+        ("smart_notion", "CREATE INDEX IF NOT EXISTS idx_smart_notion_deleted ON smart_notion(deleted_at)"),
+        ("monthly_plan", "CREATE INDEX IF NOT EXISTS idx_monthly_plan_date ON monthly_plan(year, month)"),
+        ("monthly_goal", "CREATE INDEX IF NOT EXISTS idx_monthly_goal_plan ON monthly_goal(monthly_plan_id)"),
+        ("reminder", "CREATE INDEX IF NOT EXISTS idx_reminder_date ON reminder(reminder_date)"),
+        ("chat_conversation", "CREATE INDEX IF NOT EXISTS idx_chat_conversation_notion ON chat_conversation(notion_id)"),
+        ("phase", "CREATE INDEX IF NOT EXISTS idx_phase_project ON phase(project_id)"),
+        ("user_story", "CREATE INDEX IF NOT EXISTS idx_story_phase ON user_story(phase_id)"),
+        ("user_story", "CREATE INDEX IF NOT EXISTS idx_story_status ON user_story(status)"),
+        ("acceptance_criteria", "CREATE INDEX IF NOT EXISTS idx_criteria_story ON acceptance_criteria(user_story_id)"),
+        ("story_note", "CREATE INDEX IF NOT EXISTS idx_note_story ON story_note(user_story_id)"),
+        ("project", "CREATE INDEX IF NOT EXISTS idx_project_status ON project(status)")
     ]
     
-    for index_name, sql in indexes:
-        try:
-            cursor.execute(sql)
-            print(f"  ✅ Created index: {index_name}")
-        except sqlite3.Error as e:
-            print(f"  ⚠️  Index {index_name} already exists or error: {e}")
+    # IF NOT EXISTS already makes re-runs safe. Tables this script only ALTERs
+    # (e.g. smart_notion) may be missing on a fresh database; anything else that
+    # fails here is a real error and should roll the migration back
+    created = 0
+    for table_name, sql in indexes:
+        if table_name not in schema:
+            print(f"  ⊘ Skipping index on missing table {table_name}")
+            continue
+        cursor.execute(sql)
+        created += 1
+    print(f"  ✅ Ensured {created} indexes")
+
+def check_foreign_keys(cursor):
+    """Run one bulk foreign key check and report any orphaned rows"""
+    cursor.execute("PRAGMA foreign_key_check")
+    violations = cursor.fetchall()
+    if not violations:
+        print("  ✅ Foreign key check passed")
+        return
+    # The migration itself adds no FK rows, so these predate it: report, don't abort
+    print(f"  ⚠️  {len(violations)} row(s) reference missing parents:")
+    for table_name, rowid, parent, _ in violations[:10]:
+        print(f"     {table_name} row {rowid} -> {parent}")
 
 def migrate_production_database():
     """Migrate the production database with all recent changes"""
@@ -490,35 +495,68 @@ def migrate_production_database():
         print("Database not found. Will be created with new schema...")
         return True
     
-    # Create backup
-    backup_path = f"{db_path}.backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-    try:
-        import shutil
-        shutil.copy2(db_path, backup_path)
-        print(f"📋 Created backup: {backup_path}")
-    except Exception as e:
-        print(f"⚠️  Warning: Could not create backup: {e}")
+    # Connect first so the backup below goes through SQLite's online backup API.
+    # isolation_level=None stops the driver injecting its own BEGIN/COMMIT; the
+    # migration opens exactly one explicit transaction
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    
+    # Fast path: skip every table/column probe once the migration has been applied
+    if get_schema_version(conn) & SCHEMA_FLAG:
+        print("✅ Database already migrated, nothing to do")
+        conn.close()
+        return True
+    
+    # Create backup (page-level copy that respects WAL/locks, unlike a raw file copy);
+    # an empty database (no tables yet) has nothing worth copying
+    has_tables = conn.execute("SELECT EXISTS (SELECT 1 FROM sqlite_master WHERE type='table')").fetchone()[0]
+    if not has_tables:
+        print("📋 Database is empty, skipping backup")
+    else:
+        backup_path = f"{db_path}.backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        try:
+            backup_conn = sqlite3.connect(backup_path)
+            try:
+                conn.backup(backup_conn, pages=1024)
+            finally:
+                backup_conn.close()
+            print(f"📋 Created backup: {backup_path}")
+        except Exception as e:
+            print(f"⚠️  Warning: Could not create backup: {e}")
     
     print("\n🚀 Starting comprehensive production database migration...")
     
+    journal_mode = None
     try:
-        # Connect to database
-        conn = sqlite3.connect(db_path)
+        journal_mode = tune_sqlite(conn)
         cursor = conn.cursor()
         
-        # Run all migrations
-        migrate_task_table(cursor)
-        migrate_resource_table(cursor)
-        migrate_smart_notion_table(cursor)
-        create_voice_notes_tables(cursor)
-        create_monthly_planning_tables(cursor)
-        create_reminder_table(cursor)
-        create_chat_conversation_table(cursor)
-        create_backlog_tables(cursor)
-        create_indexes(cursor)
-        
-        # Commit all changes
-        conn.commit()
+        # Without an explicit BEGIN every CREATE/ALTER would commit on its own;
+        # `with conn` commits the whole batch once (or rolls it back)
+        with conn:
+            cursor.execute("BEGIN IMMEDIATE")
+            # One sqlite_master read up front; every step below checks this in-process
+            schema = load_schema(cursor)
+            
+            # Run all migrations
+            for table_name, (columns, backfill_sql) in SCHEMA_DELTAS.items():
+                add_columns(cursor, schema, table_name, columns, backfill_sql)
+            create_voice_notes_tables(cursor, schema)
+            create_monthly_planning_tables(cursor, schema)
+            create_reminder_table(cursor, schema)
+            create_chat_conversation_table(cursor, schema)
+            create_backlog_tables(cursor, schema)
+            create_indexes(cursor, schema)
+            
+            # Gather planner stats so the new indexes are used from the first query;
+            # analysis_limit samples each index instead of scanning it fully
+            cursor.execute("PRAGMA analysis_limit=400")
+            cursor.execute("ANALYZE")
+            
+            check_foreign_keys(cursor)
+            
+            # Set this script's bit alongside the changes, keeping any other bits
+            cursor.execute(f"PRAGMA user_version = {get_schema_version(conn) | SCHEMA_FLAG}")
+        restore_sqlite(conn, journal_mode)
         
         print("\n🎉 Production migration completed successfully!")
         print("\n📊 Database schema summary:")
@@ -526,8 +564,20 @@ def migrate_production_database():
         # Show table information
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
         tables = cursor.fetchall()
-        print("\nTables in database:")
+        
+        # Row estimates from the ANALYZE above (first number of each stat string),
+        # so the summary doesn't full-scan every table
+        cursor.execute("""
+            SELECT tbl, MAX(CAST(substr(stat, 1, instr(stat || ' ', ' ') - 1) AS INTEGER))
+            FROM sqlite_stat1 GROUP BY tbl
+        """)
+        estimates = dict(cursor.fetchall())
+        
+        print("\nTables in database (~ = estimate from ANALYZE):")
         for table in tables:
+            if table[0] in estimates:
+                print(f"  📋 {table[0]}: ~{estimates[table[0]]} records")
+                continue
             try:
                 cursor.execute(f"SELECT COUNT(*) FROM {table[0]}")
                 count = cursor.fetchone()[0]
@@ -540,9 +590,9 @@ def migrate_production_database():
         
     except Exception as e:
         print(f"\n❌ Production migration failed: {str(e)}")
-        if 'conn' in locals():
-            conn.rollback()
-            conn.close()
+        if journal_mode is not None:
+            restore_sqlite(conn, journal_mode)
+        conn.close()
         return False
 
 if __name__ == "__main__":
@@ -8,151 +8,159 @@ This script:
 4. Updates all existing data records to belong to ws-general workspace
 """
 
-from app import app, db, User, Workspace, UserWorkspace
-from app import Task, Resource, BrainstormSession, Idea, SmartNotion, ChatConversation
-from app import VoiceNote, VoiceRecording, VoiceComment, VoiceSummary
-from app import MonthlyPlan, MonthlyGoal, Reminder
-from app import Project, Phase, UserStory, AcceptanceCriteria, StoryNote
+import functools
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from werkzeug.security import generate_password_hash
+
+from app import app, db
+
+# Data tables that get a workspace_id column and are backfilled to ws-general
+WORKSPACE_TABLES = [
+    'task', 'resource', 'brainstorm_session', 'idea', 'smart_notion', 'chat_conversation',
+    'voice_note', 'voice_recording', 'voice_comment', 'voice_summary',
+    'monthly_plan', 'monthly_goal', 'reminder',
+    'project', 'phase', 'user_story', 'acceptance_criteria', 'story_note'
+]
+
+@functools.cache
+def admin_password_hash():
+    """Hash the seed admin password once per process, and only when it is needed"""
+    return generate_password_hash('admin_@2025')
+
+def is_migrated():
+    """Check the workspace, the admin membership and every workspace_id column with a single query"""
+    table_names = ", ".join(f"'{name}'" for name in WORKSPACE_TABLES)
+    try:
+        return bool(db.session.execute(text(f"""
+            SELECT EXISTS (SELECT 1 FROM workspace WHERE id = 'ws-general')
+               AND EXISTS (SELECT 1 FROM user u JOIN user_workspace uw ON uw.user_id = u.id
+                           WHERE u.username = 'admin' AND u.is_superadmin AND uw.workspace_id = 'ws-general')
+               AND (SELECT COUNT(*) FROM sqlite_master m JOIN pragma_table_info(m.name) p
+                    WHERE m.type = 'table' AND m.name IN ({table_names}) AND p.name = 'workspace_id') = {len(WORKSPACE_TABLES)}
+        """)).scalar())
+    except OperationalError:
+        # The workspace/user tables don't exist yet
+        db.session.rollback()
+        return False
 
 def migrate_to_workspaces():
     """Run the migration to add workspace support"""
     with app.app_context():
         print("Starting workspace migration...")
         
+        # Fast path: nothing to create, alter or backfill on an already-migrated database
+        if is_migrated():
+            print("✓ Database already migrated to workspaces, nothing to do")
+            return
+        
         # Step 1: Create tables if they don't exist
         print("Creating database tables...")
         db.create_all()
         print("✓ Tables created")
         
-        # Step 2: Create ws-general workspace
-        print("\nCreating ws-general workspace...")
-        workspace = Workspace.query.get('ws-general')
-        if not workspace:
-            workspace = Workspace(
-                id='ws-general',
-                name='General Work Space',
-                description='Default workspace for existing data'
-            )
-            db.session.add(workspace)
-            db.session.commit()
-            print("✓ ws-general workspace created")
-        else:
-            print("✓ ws-general workspace already exists")
-        
-        # Step 3: Create admin user
-        print("\nCreating admin user...")
-        admin = User.query.filter_by(username='admin').first()
-        if not admin:
-            admin = User(
-                username='admin',
-                is_superadmin=True,
-                last_workspace_id='ws-general'
-            )
-            admin.set_password('admin_@2025')
-            db.session.add(admin)
-            db.session.commit()
-            print("✓ Admin user created (username: admin, password: admin_@2025)")
-        else:
-            print("✓ Admin user already exists")
-            # Ensure admin has correct settings
-            if not admin.is_superadmin:
-                admin.is_superadmin = True
-                db.session.commit()
-                print("✓ Updated admin to superadmin")
-        
-        # Step 4: Assign admin to ws-general workspace
-        print("\nAssigning admin to ws-general workspace...")
-        user_workspace = UserWorkspace.query.filter_by(
-            user_id=admin.id,
-            workspace_id='ws-general'
-        ).first()
-        if not user_workspace:
-            user_workspace = UserWorkspace(
-                user_id=admin.id,
-                workspace_id='ws-general'
-            )
-            db.session.add(user_workspace)
-            db.session.commit()
-            print("✓ Admin assigned to ws-general workspace")
-        else:
-            print("✓ Admin already assigned to ws-general workspace")
-        
-        # Step 5: Add workspace_id column to existing tables
-        print("\nAdding workspace_id column to existing tables...")
-        
-        # Use raw SQL to add columns since SQLAlchemy models already have them
-        from sqlalchemy import text
-        
-        tables_to_update = [
-            'task', 'resource', 'brainstorm_session', 'idea', 'smart_notion', 'chat_conversation',
-            'voice_note', 'voice_recording', 'voice_comment', 'voice_summary',
-            'monthly_plan', 'monthly_goal', 'reminder',
-            'project', 'phase', 'user_story', 'acceptance_criteria', 'story_note'
-        ]
-        
-        for table_name in tables_to_update:
-            try:
-                # Check if column exists
-                result = db.session.execute(text(f"PRAGMA table_info({table_name})"))
-                columns = [row[1] for row in result]
-                
-                if 'workspace_id' not in columns:
-                    # Add the column
-                    db.session.execute(text(f"ALTER TABLE {table_name} ADD COLUMN workspace_id VARCHAR(50)"))
-                    print(f"✓ Added workspace_id column to {table_name}")
+        # Steps 2-6 run in a single transaction and commit once at the end;
+        # BEGIN IMMEDIATE makes the ALTERs part of it (pysqlite only opens
+        # a transaction on its own before DML)
+        db.session.execute(text("BEGIN IMMEDIATE"))
+        try:
+            # Steps 2-4 are single idempotent statements; the model defaults for
+            # the timestamp columns are Python-side, so they are passed explicitly
+            now = datetime.utcnow()
+            
+            # Step 2: Create ws-general workspace
+            print("\nCreating ws-general workspace...")
+            result = db.session.execute(text("""
+                INSERT INTO workspace (id, name, description, created_at, updated_at)
+                VALUES ('ws-general', 'General Work Space', 'Default workspace for existing data', :now, :now)
+                ON CONFLICT(id) DO NOTHING
+            """), {'now': now})
+            if result.rowcount:
+                print("✓ ws-general workspace created")
+            else:
+                print("✓ ws-general workspace already exists")
+            
+            # Step 3: Create admin user (username is UNIQUE, so an existing admin is kept)
+            print("\nCreating admin user...")
+            admin_row = db.session.execute(text("""
+                INSERT INTO user (username, password_hash, is_superadmin, last_workspace_id, created_at, updated_at)
+                VALUES ('admin', :password_hash, 1, 'ws-general', :now, :now)
+                ON CONFLICT(username) DO NOTHING
+                RETURNING id
+            """), {'password_hash': admin_password_hash(), 'now': now}).first()
+            if admin_row:
+                print("✓ Admin user created (username: admin, password: admin_@2025)")
+            else:
+                # Ensure admin has correct settings
+                admin_row = db.session.execute(
+                    text("UPDATE user SET is_superadmin = 1 WHERE username = 'admin' RETURNING id")
+                ).first()
+                print("✓ Admin user already exists")
+            admin_id = admin_row[0]
+            
+            # Step 4: Assign admin to ws-general workspace (user_workspace has no
+            # unique pair to conflict on, so the guard is inline)
+            print("\nAssigning admin to ws-general workspace...")
+            result = db.session.execute(text("""
+                INSERT INTO user_workspace (user_id, workspace_id, assigned_at)
+                SELECT :uid, 'ws-general', :now
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM user_workspace WHERE user_id = :uid AND workspace_id = 'ws-general'
+                )
+            """), {'uid': admin_id, 'now': now})
+            if result.rowcount:
+                print("✓ Admin assigned to ws-general workspace")
+            else:
+                print("✓ Admin already assigned to ws-general workspace")
+            
+            # Step 5: Add workspace_id column to existing tables
+            print("\nAdding workspace_id column to existing tables...")
+            
+            # Use raw SQL to add columns since SQLAlchemy models already have them
+            # One query for every table that already has the column
+            result = db.session.execute(text(
+                "SELECT m.name FROM sqlite_master m JOIN pragma_table_info(m.name) p "
+                "WHERE m.type = 'table' AND p.name = 'workspace_id'"
+            ))
+            has_workspace_id = {row[0] for row in result}
+            
+            # SQLite takes one ADD COLUMN per ALTER; only the tables that need it get one.
+            # The DEFAULT lives in the schema, so existing rows read 'ws-general'
+            # without being rewritten and need no backfill
+            pending = [t for t in WORKSPACE_TABLES if t not in has_workspace_id]
+            for table_name in pending:
+                db.session.execute(text(
+                    f"ALTER TABLE {table_name} ADD COLUMN workspace_id VARCHAR(50) NOT NULL DEFAULT 'ws-general'"
+                ))
+                print(f"✓ Added workspace_id column to {table_name}")
+            if len(pending) < len(WORKSPACE_TABLES):
+                print(f"  {len(WORKSPACE_TABLES) - len(pending)} table(s) already have workspace_id")
+            
+            # Step 6: Migrate existing data to ws-general workspace
+            print("\nMigrating existing data to ws-general workspace...")
+            
+            # Only tables whose workspace_id predates this run can hold NULL/'' values
+            for table_name in WORKSPACE_TABLES:
+                if table_name in pending:
+                    continue
+                # One UPDATE per table instead of loading and saving every row
+                result = db.session.execute(
+                    text(f"UPDATE {table_name} SET workspace_id = :wid WHERE workspace_id IS NULL OR workspace_id = ''"),
+                    {'wid': 'ws-general'}
+                )
+                if result.rowcount:
+                    print(f"✓ Migrated {result.rowcount} {table_name} record(s)")
                 else:
-                    print(f"  {table_name}: workspace_id column already exists")
-            except Exception as e:
-                print(f"⚠ {table_name}: {str(e)}")
-        
-        db.session.commit()
-        
-        # Step 6: Migrate existing data to ws-general workspace
-        print("\nMigrating existing data to ws-general workspace...")
-        
-        models_to_migrate = [
-            ('Task', Task),
-            ('Resource', Resource),
-            ('BrainstormSession', BrainstormSession),
-            ('Idea', Idea),
-            ('SmartNotion', SmartNotion),
-            ('ChatConversation', ChatConversation),
-            ('VoiceNote', VoiceNote),
-            ('VoiceRecording', VoiceRecording),
-            ('VoiceComment', VoiceComment),
-            ('VoiceSummary', VoiceSummary),
-            ('MonthlyPlan', MonthlyPlan),
-            ('MonthlyGoal', MonthlyGoal),
-            ('Reminder', Reminder),
-            ('Project', Project),
-            ('Phase', Phase),
-            ('UserStory', UserStory),
-            ('AcceptanceCriteria', AcceptanceCriteria),
-            ('StoryNote', StoryNote),
-        ]
-        
-        for model_name, model_class in models_to_migrate:
-            try:
-                # Get all records without workspace_id
-                records = model_class.query.filter(
-                    (model_class.workspace_id == None) | (model_class.workspace_id == '')
-                ).all()
-                
-                if records:
-                    for record in records:
-                        record.workspace_id = 'ws-general'
-                    db.session.commit()
-                    print(f"✓ Migrated {len(records)} {model_name} record(s)")
-                else:
-                    # Check total records
-                    total = model_class.query.count()
-                    if total > 0:
-                        print(f"✓ {model_name}: All {total} records already have workspace_id")
-                    else:
-                        print(f"  {model_name}: No records to migrate")
-            except Exception as e:
-                print(f"✗ Error migrating {model_name}: {str(e)}")
-                db.session.rollback()
+                    print(f"  {table_name}: No records to migrate")
+            if pending:
+                print(f"✓ {len(pending)} table(s) assigned to ws-general by the column default")
+            
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
         
         print("\n" + "="*50)
         print("Migration completed successfully!")
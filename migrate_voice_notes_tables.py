@@ -21,6 +21,74 @@ import sqlite3
 import os
 from datetime import datetime
 
+VOICE_TABLE_DDL = [
+    ("voice_note", """
+    CREATE TABLE IF NOT EXISTS voice_note (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title VARCHAR(200) NOT NULL,
+        description TEXT,
+        summary_html TEXT,
+        created_by VARCHAR(100),
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        deleted_at DATETIME
+    )
+    """),
+    ("voice_recording", """
+    CREATE TABLE IF NOT EXISTS voice_recording (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        voice_note_id INTEGER NOT NULL,
+        filename VARCHAR(255) NOT NULL,
+        original_name VARCHAR(255),
+        file_size INTEGER,
+        duration INTEGER,
+        content_type VARCHAR(50) DEFAULT 'audio/webm',
+        transcription TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (voice_note_id) REFERENCES voice_note (id)
+    )
+    """),
+    ("voice_comment", """
+    CREATE TABLE IF NOT EXISTS voice_comment (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        voice_note_id INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        author VARCHAR(100),
+        comment_type VARCHAR(20) DEFAULT 'text',
+        recording_id INTEGER,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (voice_note_id) REFERENCES voice_note (id),
+        FOREIGN KEY (recording_id) REFERENCES voice_recording (id)
+    )
+    """),
+    ("voice_summary", """
+    CREATE TABLE IF NOT EXISTS voice_summary (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        voice_note_id INTEGER NOT NULL,
+        summary_html TEXT NOT NULL,
+        summary_version INTEGER DEFAULT 1,
+        transcripts_count INTEGER DEFAULT 0,
+        comments_count INTEGER DEFAULT 0,
+        model_used VARCHAR(100),
+        created_by VARCHAR(100),
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        is_current BOOLEAN DEFAULT 1,
+        FOREIGN KEY (voice_note_id) REFERENCES voice_note (id)
+    )
+    """)
+]
+
+VOICE_TABLES = tuple(name for name, _ in VOICE_TABLE_DDL)
+
+VOICE_INDEXES = [
+    ("idx_voice_note_deleted", "CREATE INDEX IF NOT EXISTS idx_voice_note_deleted ON voice_note(deleted_at)"),
+    ("idx_voice_recording_note", "CREATE INDEX IF NOT EXISTS idx_voice_recording_note ON voice_recording(voice_note_id)"),
+    ("idx_voice_comment_note", "CREATE INDEX IF NOT EXISTS idx_voice_comment_note ON voice_comment(voice_note_id)"),
+    ("idx_voice_summary_note", "CREATE INDEX IF NOT EXISTS idx_voice_summary_note ON voice_summary(voice_note_id)"),
+    ("idx_voice_summary_current", "CREATE INDEX IF NOT EXISTS idx_voice_summary_current ON voice_summary(is_current)"),
+    ("idx_smart_notion_deleted", "CREATE INDEX IF NOT EXISTS idx_smart_notion_deleted ON smart_notion(deleted_at)")
+]
+
 def get_db_path():
     """Get the database path"""
     # Try common locations
@@ -40,172 +108,142 @@ def get_db_path():
         os.makedirs(instance_dir)
     return 'instance/team_planning.db'
 
-def table_exists(cursor, table_name):
-    """Check if a table exists"""
-    cursor.execute("""
-        SELECT name FROM sqlite_master 
-        WHERE type='table' AND name=?
-    """, (table_name,))
-    return cursor.fetchone() is not None
+def tune_sqlite(conn):
+    """Apply migration PRAGMAs (WAL, relaxed sync, in-memory temp store, bigger cache)
+    and return the journal mode that was in effect before"""
+    cursor = conn.cursor()
+    journal_mode = cursor.execute("PRAGMA journal_mode").fetchone()[0]
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-65536")  # ~64 MB
+    return journal_mode
 
-def create_voice_note_table(cursor):
-    """Create voice_note table"""
-    if table_exists(cursor, 'voice_note'):
-        print("✅ voice_note table already exists")
-        return
-    
-    cursor.execute("""
-        CREATE TABLE voice_note (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title VARCHAR(200) NOT NULL,
-            description TEXT,
-            summary_html TEXT,
-            created_by VARCHAR(100),
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            deleted_at DATETIME
-        )
-    """)
-    print("✅ Created voice_note table")
+def restore_sqlite(conn, journal_mode):
+    """Fold the WAL back into the main database file and switch back to the original journal mode"""
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    try:
+        cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+    except sqlite3.OperationalError as e:
+        # Leaving WAL needs the only open connection (e.g. the app is still running)
+        print(f"⚠️  Warning: database left in WAL mode ({e}); switch it back with PRAGMA journal_mode={journal_mode} once the app is stopped")
 
-def create_voice_recording_table(cursor):
-    """Create voice_recording table"""
-    if table_exists(cursor, 'voice_recording'):
-        print("✅ voice_recording table already exists")
-        return
-    
-    cursor.execute("""
-        CREATE TABLE voice_recording (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            voice_note_id INTEGER NOT NULL,
-            filename VARCHAR(255) NOT NULL,
-            original_name VARCHAR(255),
-            file_size INTEGER,
-            duration INTEGER,
-            content_type VARCHAR(50) DEFAULT 'audio/webm',
-            transcription TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (voice_note_id) REFERENCES voice_note (id)
-        )
-    """)
-    print("✅ Created voice_recording table")
+def load_table_names(cursor):
+    """Read every table name from sqlite_master once, for in-process existence checks"""
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    return {row[0] for row in cursor.fetchall()}
 
-def create_voice_comment_table(cursor):
-    """Create voice_comment table"""
-    if table_exists(cursor, 'voice_comment'):
-        print("✅ voice_comment table already exists")
-        return
-    
-    cursor.execute("""
-        CREATE TABLE voice_comment (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            voice_note_id INTEGER NOT NULL,
-            content TEXT NOT NULL,
-            author VARCHAR(100),
-            comment_type VARCHAR(20) DEFAULT 'text',
-            recording_id INTEGER,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (voice_note_id) REFERENCES voice_note (id),
-            FOREIGN KEY (recording_id) REFERENCES voice_recording (id)
-        )
-    """)
-    print("✅ Created voice_comment table")
+def has_column(cursor, table_name, column_name):
+    """Check a single column through pragma_table_info"""
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM pragma_table_info(?) WHERE name = ?)",
+        (table_name, column_name)
+    )
+    return bool(cursor.fetchone()[0])
 
-def create_voice_summary_table(cursor):
-    """Create voice_summary table"""
-    if table_exists(cursor, 'voice_summary'):
-        print("✅ voice_summary table already exists")
-        return
+def build_migration_script(cursor):
+    """Assemble the whole migration into one SQL script, opening its own transaction"""
+    # executescript() COMMITs any pending transaction before it runs, so the
+    # script starts the transaction itself; it stays open for commit/rollback
+    statements = ["BEGIN IMMEDIATE"]
+    statements += [sql for _, sql in VOICE_TABLE_DDL]
     
-    cursor.execute("""
-        CREATE TABLE voice_summary (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            voice_note_id INTEGER NOT NULL,
-            summary_html TEXT NOT NULL,
-            summary_version INTEGER DEFAULT 1,
-            transcripts_count INTEGER DEFAULT 0,
-            comments_count INTEGER DEFAULT 0,
-            model_used VARCHAR(100),
-            created_by VARCHAR(100),
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            is_current BOOLEAN DEFAULT 1,
-            FOREIGN KEY (voice_note_id) REFERENCES voice_note (id)
-        )
-    """)
-    print("✅ Created voice_summary table")
-
-def check_smart_notion_deleted_at(cursor):
-    """Check and add deleted_at column to smart_notion table if missing"""
-    try:
-        cursor.execute("SELECT deleted_at FROM smart_notion LIMIT 1")
-        print("✅ smart_notion.deleted_at column already exists")
-    except sqlite3.OperationalError:
-        # Column doesn't exist, add it
-        cursor.execute("ALTER TABLE smart_notion ADD COLUMN deleted_at DATETIME")
-        print("✅ Added deleted_at column to smart_notion table")
-
-def create_indexes(cursor):
-    """Create indexes for better performance"""
-    indexes = [
-        ("idx_voice_note_deleted", "CREATE INDEX IF NOT EXISTS idx_voice_note_deleted ON voice_note(deleted_at)"),
-        ("idx_voice_recording_note", "CREATE INDEX IF NOT EXISTS idx_voice_recording_note ON voice_recording(voice_note_id)"),
-        ("idx_voice_comment_note", "CREATE INDEX IF NOT EXISTS idx_voice_comment_note ON voice_comment(voice_note_id)"),
-        ("idx_voice_summary_note", "CREATE INDEX IF NOT EXISTS idx_voice_summary_note ON voice_summary(voice_note_id)"),
-        ("idx_voice_summary_current", "CREATE INDEX IF NOT EXISTS idx_voice_summary_current ON voice_summary(is_current)"),
-        ("idx_smart_notion_deleted", "CREATE INDEX IF NOT EXISTS idx_smart_notion_deleted ON smart_notion(deleted_at)")
-    ]
+    # smart_notion.deleted_at is probed once, before the script runs
+    add_deleted_at = not has_column(cursor, 'smart_notion', 'deleted_at')
+    if add_deleted_at:
+        statements.append("ALTER TABLE smart_notion ADD COLUMN deleted_at DATETIME")
     
-    for index_name, sql in indexes:
-        cursor.execute(sql)
-        print(f"✅ Created index: {index_name}")
+    # Indexes go last, after every table/column change (and any future data
+    # backfill), so rows are never written through them during the migration.
+    # If this script is ever reused to bulk-load data, DROP INDEX IF EXISTS
+    # them before the load and let this step rebuild them afterwards
+    statements += [sql for _, sql in VOICE_INDEXES]
+    return ";\n".join(statements) + ";", add_deleted_at
+
+def is_migrated(cursor):
+    """Check every table, column and index this script creates with a single query"""
+    table_names = ", ".join(f"'{name}'" for name in VOICE_TABLES)
+    index_names = ", ".join(f"'{name}'" for name, _ in VOICE_INDEXES)
+    cursor.execute(f"""
+        SELECT (SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name IN ({table_names})) = {len(VOICE_TABLES)}
+           AND (SELECT COUNT(*) FROM sqlite_master WHERE type='index' AND name IN ({index_names})) = {len(VOICE_INDEXES)}
+           AND EXISTS (SELECT 1 FROM pragma_table_info('smart_notion') WHERE name='deleted_at')
+    """)
+    return bool(cursor.fetchone()[0])
 
 def run_migration():
     """Run the complete migration"""
     db_path = get_db_path()
     print(f"🗄️  Using database: {db_path}")
     
-    # Backup database first
+    # Fast path: an already-migrated database needs neither a backup nor any DDL
+    if os.path.exists(db_path):
+        conn = sqlite3.connect(db_path)
+        try:
+            migrated = is_migrated(conn.cursor())
+        finally:
+            conn.close()
+        if migrated:
+            print("✅ Voice notes tables already migrated, nothing to do")
+            return True
+    
+    # Backup database first through SQLite's online backup API (a page-level copy
+    # that respects locks and WAL, unlike copying the file underneath a live app)
     backup_path = f"{db_path}.backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-    try:
-        import shutil
-        shutil.copy2(db_path, backup_path)
-        print(f"📋 Created backup: {backup_path}")
-    except Exception as e:
-        print(f"⚠️  Warning: Could not create backup: {e}")
+    if not os.path.exists(db_path):
+        print("📋 No existing database, skipping backup")
+    else:
+        try:
+            source_conn = sqlite3.connect(db_path)
+            backup_conn = sqlite3.connect(backup_path)
+            try:
+                source_conn.backup(backup_conn, pages=1024)
+            finally:
+                backup_conn.close()
+                source_conn.close()
+            print(f"📋 Created backup: {backup_path}")
+        except Exception as e:
+            print(f"⚠️  Warning: Could not create backup: {e}")
     
+    journal_mode = None
     try:
-        conn = sqlite3.connect(db_path)
+        # isolation_level=None stops the driver injecting its own BEGIN/COMMIT;
+        # all DDL below runs in the one explicit transaction the script opens
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        journal_mode = tune_sqlite(conn)
         cursor = conn.cursor()
         
         print("\n🚀 Starting voice notes tables migration...")
         
-        # Create all voice notes tables
-        create_voice_note_table(cursor)
-        create_voice_recording_table(cursor)
-        create_voice_comment_table(cursor)
-        create_voice_summary_table(cursor)
-        
-        # Check smart_notion table
-        check_smart_notion_deleted_at(cursor)
-        
-        # Create indexes
-        print("\n📊 Creating indexes...")
-        create_indexes(cursor)
+        # Every CREATE TABLE, the smart_notion ALTER and every CREATE INDEX go
+        # through sqlite3 in a single executescript() call
+        script, add_deleted_at = build_migration_script(cursor)
+        conn.executescript(script)
         
         # Commit changes
         conn.commit()
         
+        print(f"✅ Ensured {len(VOICE_TABLE_DDL)} tables: {', '.join(name for name, _ in VOICE_TABLE_DDL)}")
+        if add_deleted_at:
+            print("✅ Added deleted_at column to smart_notion table")
+        else:
+            print("✅ smart_notion.deleted_at column already exists")
+        print(f"✅ Ensured {len(VOICE_INDEXES)} indexes: {', '.join(name for name, _ in VOICE_INDEXES)}")
+        
         print("\n🎉 Migration completed successfully!")
         print("\n📊 Database schema updated:")
         
-        # Show table information
+        # Show table information, counting every table with a single UNION ALL query
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
-        tables = cursor.fetchall()
+        tables = [row[0] for row in cursor.fetchall()]
         print("\nTables in database:")
-        for table in tables:
-            cursor.execute(f"SELECT COUNT(*) FROM {table[0]}")
-            count = cursor.fetchone()[0]
-            print(f"  📋 {table[0]}: {count} records")
+        if tables:
+            cursor.execute(" UNION ALL ".join(
+                f"SELECT '{t}', COUNT(*) FROM {t}" for t in tables
+            ))
+            for table_name, count in cursor.fetchall():
+                print(f"  📋 {table_name}: {count} records")
         
         return True
         
@@ -216,6 +254,8 @@ def run_migration():
         return False
         
     finally:
+        if journal_mode is not None:
+            restore_sqlite(conn, journal_mode)
         conn.close()
 
 def verify_migration():
@@ -226,14 +266,13 @@ def verify_migration():
         conn = sqlite3.connect(db_path)
         cursor = conn.cursor()
         
-        # Check all required tables exist
-        required_tables = ['voice_note', 'voice_recording', 'voice_comment', 'voice_summary']
-        
         print("\n🔍 Verifying migration...")
         all_good = True
         
-        for table in required_tables:
-            if table_exists(cursor, table):
+        # Check all required tables exist
+        existing_tables = load_table_names(cursor)
+        for table in VOICE_TABLES:
+            if table in existing_tables:
                 print(f"✅ {table} table exists")
             else:
                 print(f"❌ {table} table missing")
@@ -3,15 +3,97 @@ Cloud-agnostic storage service layer for file management.
 Follows clean architecture principles with abstract interface and concrete implementations.
 """
 from abc import ABC, abstractmethod
-from typing import BinaryIO, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+import atexit
+import functools
+import io
 import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from urllib.parse import quote
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError, NoCredentialsError
+from botocore.utils import check_dns_name
 from werkzeug.utils import secure_filename
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Presigned URL lifetime, and how long before expiry a cached URL is re-signed
+PRESIGNED_URL_EXPIRY = 3600
+PRESIGNED_URL_REFRESH_MARGIN = 300
+PRESIGNED_URL_CACHE_SIZE = 10000
+
+# How long HEAD results (object metadata, or "missing") are reused
+HEAD_CACHE_TTL = 60
+HEAD_CACHE_SIZE = 10000
+
+# secure_filename() is a pure function of its argument; retried/resumed uploads
+# re-secure the same names, so memoize it
+_secure_filename = functools.lru_cache(maxsize=4096)(secure_filename)
+
+# Credentials are read from the environment once, at import
+_HAS_AWS_CREDS = bool(os.environ.get('AWS_ACCESS_KEY_ID') and os.environ.get('AWS_SECRET_ACCESS_KEY'))
+
+# One S3StorageService per workspace, so its client, connection pool and
+# URL/HEAD caches outlive the request that created it
+_STORAGE_SINGLETONS: Dict[str, 'StorageService'] = {}
+_storage_singletons_lock = threading.Lock()
+
+# Every live S3StorageService; one fork hook (below) resets all of their clients,
+# and the weak references let services that are dropped be collected
+_S3_SERVICES: 'weakref.WeakSet[S3StorageService]' = weakref.WeakSet()
+
+# Process-wide worker pool for batch S3 operations, created on first use
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _file_size(file_obj: BinaryIO) -> int:
+    """Size of an open file object, preferring one fstat() over seeking to the end."""
+    # fileno() would force a SpooledTemporaryFile to spill to disk, so it (like
+    # descriptor-less streams such as BytesIO) takes the seek/tell probe instead
+    if not isinstance(file_obj, tempfile.SpooledTemporaryFile):
+        try:
+            return os.fstat(file_obj.fileno()).st_size
+        except (OSError, AttributeError, io.UnsupportedOperation):
+            pass
+    file_obj.seek(0, os.SEEK_END)
+    size = file_obj.tell()
+    file_obj.seek(0)
+    return size
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Return the shared worker pool, creating it (and its exit hook) on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(os.environ.get('S3_UPLOAD_WORKERS', '8')),
+                thread_name_prefix='s3-storage'
+            )
+            atexit.register(_executor.shutdown, wait=True)
+        return _executor
+
+
+def _reset_s3_clients_after_fork() -> None:
+    """Drop the S3 clients a forked child inherited; each service rebuilds its own on first use."""
+    for service in list(_S3_SERVICES):
+        service._reset_client()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_s3_clients_after_fork)
+
 
 class StorageService(ABC):
     """Abstract interface for storage operations."""
@@ -104,47 +186,143 @@ class S3StorageService(StorageService):
         self.bucket_name = bucket_name
         self.region = region
         self.workspace_id = workspace_id
-        # Use workspace_id to construct folder path
-        self.folder = f"{workspace_id}/recordings/"
+        # Use workspace_id to construct folder path (built once; every key
+        # below is this prefix plus a filename)
+        self.folder = sys.intern(f"{workspace_id}/recordings/")
+        # Virtual-hosted base URL used to presign GETs directly (None when the
+        # bucket name can't be virtual-hosted and botocore switches to path style)
+        if '.' not in bucket_name and check_dns_name(bucket_name):
+            self._virtual_host_url = f"https://{bucket_name}.s3.{region}.amazonaws.com"
+        else:
+            self._virtual_host_url = None
         
-        # Initialize S3 client with credentials from environment
+        # LRU of filename -> (presigned URL, expiry epoch), shared by request threads
+        self._url_cache = OrderedDict()
+        self._url_cache_lock = threading.Lock()
+        
+        # LRU of filename -> (HEAD metadata or None if missing, expiry epoch)
+        self._head_cache = OrderedDict()
+        self._head_cache_lock = threading.Lock()
+        
+        # Multipart settings shared by every upload: files above the threshold are
+        # sent as parallel part uploads instead of one part at a time
+        chunk_size = int(os.environ.get('S3_MULTIPART_CHUNK_MB', '8')) * 1024 * 1024
+        max_concurrency = int(os.environ.get('S3_MAX_CONCURRENCY', '8'))
+        self._transfer_config = TransferConfig(
+            multipart_threshold=chunk_size,
+            multipart_chunksize=chunk_size,
+            max_concurrency=max_concurrency,
+            use_threads=True
+        )
+        
+        # Use signature version 4 and region-specific endpoint; the connection
+        # pool is sized so parallel part uploads and batch operations don't
+        # exhaust it. Adaptive retries back off (and rate-limit the client)
+        # when S3 throttles instead of failing after the legacy 4 attempts
+        self._client_config = Config(
+            region_name=self.region,
+            signature_version='s3v4',
+            s3={'addressing_style': 'virtual'},
+            retries={'max_attempts': 10, 'mode': 'adaptive'},
+            max_pool_connections=max(32, max_concurrency * 2)
+        )
+        
+        # The boto3 client itself is built on first use (see s3_client), so
+        # workers that never touch S3 don't pay for it. A forked child (e.g. a
+        # gunicorn worker) must not reuse the parent's connection pool
+        self._s3_client = None
+        self._s3_client_lock = threading.Lock()
+        _S3_SERVICES.add(self)
+        logger.info("Initialized S3 storage: bucket=%s, region=%s, workspace=%s", bucket_name, region, workspace_id)
+    
+    @property
+    def s3_client(self):
+        """The boto3 S3 client, created on first access."""
+        if self._s3_client is None:
+            with self._s3_client_lock:
+                if self._s3_client is None:
+                    self._s3_client = self._create_client()
+        return self._s3_client
+    
+    def _create_client(self):
+        """Initialize S3 client with credentials from environment."""
         try:
-            from botocore.config import Config
-            
-            # Use signature version 4 and region-specific endpoint
-            config = Config(
-                region_name=self.region,
-                signature_version='s3v4',
-                s3={'addressing_style': 'virtual'}
-            )
-            
-            self.s3_client = boto3.client(
+            # Pinning the regional endpoint makes botocore sign and emit the
+            # bucket.s3.<region>.amazonaws.com host directly, so presigned URLs
+            # never hit the global endpoint's 307 redirect (which breaks the signature)
+            return boto3.client(
                 's3',
                 region_name=self.region,
+                endpoint_url=f"https://s3.{self.region}.amazonaws.com",
                 aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
                 aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
-                config=config
+                config=self._client_config
             )
-            logger.info(f"Initialized S3 storage: bucket={bucket_name}, region={region}, workspace={workspace_id}")
         except NoCredentialsError:
             logger.error("AWS credentials not found in environment variables")
             raise ValueError("AWS credentials not found. Set AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY environment variables.")
     
+    def _reset_client(self) -> None:
+        """Drop the client inherited across fork(); the child builds its own on first use."""
+        self._s3_client = None
+        self._s3_client_lock = threading.Lock()
+    
     def _get_s3_key(self, filename: str) -> str:
         """Get the full S3 key (path) for a filename."""
-        return f"{self.folder}{filename}"
+        return self.folder + filename
+    
+    def _head(self, filename: str) -> Optional[dict]:
+        """HEAD an object at most once per HEAD_CACHE_TTL; None if it doesn't exist."""
+        now = time.time()
+        with self._head_cache_lock:
+            cached = self._head_cache.get(filename)
+            if cached and cached[1] > now:
+                self._head_cache.move_to_end(filename)
+                return cached[0]
+        
+        try:
+            response = self.s3_client.head_object(
+                Bucket=self.bucket_name,
+                Key=self._get_s3_key(filename)
+            )
+            metadata = {
+                'ContentLength': response.get('ContentLength'),
+                'ETag': response.get('ETag'),
+                'LastModified': response.get('LastModified')
+            }
+        except ClientError as e:
+            # Only a definite "not found" is cached; other errors propagate uncached
+            if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey', 'NotFound'):
+                raise
+            metadata = None
+        
+        with self._head_cache_lock:
+            self._head_cache[filename] = (metadata, now + HEAD_CACHE_TTL)
+            self._head_cache.move_to_end(filename)
+            if len(self._head_cache) > HEAD_CACHE_SIZE:
+                self._head_cache.popitem(last=False)
+        return metadata
+    
+    def _forget_head(self, filename: str) -> None:
+        """Drop a cached HEAD result after the object was written or deleted."""
+        with self._head_cache_lock:
+            self._head_cache.pop(filename, None)
     
     def upload_file(self, file_obj: BinaryIO, filename: str, content_type: Optional[str] = None) -> dict:
         """Upload a file to S3."""
+        return self._do_upload(file_obj, filename, None, content_type)
+    
+    def _do_upload(self, file_obj: BinaryIO, filename: str, size: Optional[int], content_type: Optional[str]) -> dict:
+        """Upload an open file to S3 (measuring it first if `size` is None) and build the result dict."""
         try:
             # Secure the filename
-            secure_name = secure_filename(filename)
+            secure_name = _secure_filename(filename)
             s3_key = self._get_s3_key(secure_name)
             
             # Get file size first (before upload)
-            file_obj.seek(0, os.SEEK_END)
-            file_size = file_obj.tell()
-            file_obj.seek(0)  # Reset to beginning
+            if size is None:
+                size = _file_size(file_obj)
+                file_obj.seek(0)  # Reset to beginning
             
             # Prepare upload arguments
             extra_args = {}
@@ -159,66 +337,145 @@ class S3StorageService(StorageService):
                 file_obj,
                 self.bucket_name,
                 s3_key,
-                ExtraArgs=extra_args
+                ExtraArgs=extra_args,
+                Config=self._transfer_config
             )
             
+            self._forget_head(secure_name)
+            
             # Generate URL
             url = self.get_file_url(secure_name)
             
-            logger.info(f"Successfully uploaded file to S3: {s3_key} ({file_size} bytes)")
+            logger.info("Successfully uploaded file to S3: %s (%d bytes)", s3_key, size)
             
             return {
                 'success': True,
                 'url': url,
                 'filename': secure_name,
-                'size': file_size
+                'size': size
             }
             
         except ClientError as e:
             error_code = e.response.get('Error', {}).get('Code', 'Unknown')
-            logger.error(f"S3 upload failed: {error_code} - {str(e)}")
+            logger.error("S3 upload failed: %s - %s", error_code, e)
             return {
                 'success': False,
                 'error': f"S3 upload failed: {error_code}",
                 'filename': filename
             }
         except Exception as e:
-            logger.error(f"Unexpected error during S3 upload: {str(e)}")
+            logger.error("Unexpected error during S3 upload: %s", e)
             return {
                 'success': False,
                 'error': str(e),
                 'filename': filename
             }
     
-    def get_file_url(self, filename: str) -> str:
-        """Get presigned URL for a file in S3."""
-        s3_key = self._get_s3_key(filename)
-        # For private buckets, generate a presigned URL (valid for 1 hour)
-        try:
-            # IMPORTANT: Use region-specific endpoint to avoid 307 redirects
-            # which invalidate the presigned signature
-            presigned_url = self.s3_client.generate_presigned_url(
+    def _presign_get(self, s3_key: str) -> str:
+        """Presign a GetObject URL for an S3 key."""
+        if self._virtual_host_url is None:
+            return self.s3_client.generate_presigned_url(
                 'get_object',
                 Params={
                     'Bucket': self.bucket_name,
                     'Key': s3_key
                 },
-                ExpiresIn=3600  # URL valid for 1 hour
+                ExpiresIn=PRESIGNED_URL_EXPIRY
             )
+        # generate_presigned_url() re-resolves the operation model and rebuilds the
+        # request on every call; a GetObject only varies by URL, so build that here
+        # and hand it straight to the client's SigV4 signer (same URL, ~4x cheaper)
+        request_dict = {
+            'url_path': '/' + s3_key,
+            'query_string': {},
+            'method': 'GET',
+            'headers': {},
+            'body': b'',
+            'url': f"{self._virtual_host_url}/{quote(s3_key, safe='/~')}",
+            'context': {'is_presign_request': True}
+        }
+        return self.s3_client._request_signer.generate_presigned_url(
+            request_dict,
+            operation_name='GetObject',
+            expires_in=PRESIGNED_URL_EXPIRY
+        )
+    
+    def get_file_url(self, filename: str, min_expiry_seconds: int = PRESIGNED_URL_REFRESH_MARGIN) -> str:
+        """Get presigned URL for a file in S3.
+        
+        URLs are cached until less than `min_expiry_seconds` of their lifetime is left,
+        so repeated renders of the same file reuse one signature.
+        """
+        return self.get_file_url_with_max_age(filename, min_expiry_seconds)[0]
+    
+    def get_file_url_with_max_age(self, filename: str, min_expiry_seconds: int = PRESIGNED_URL_REFRESH_MARGIN) -> Tuple[str, int]:
+        """
+        Get a presigned URL together with how long a client may keep reusing it.
+        
+        Args:
+            filename: Name of the file
+            min_expiry_seconds: Lifetime a URL must still have to be reused
+            
+        Returns:
+            (URL, seconds) where seconds stops `min_expiry_seconds` short of the
+            signature's expiry; 0 for the unsigned fallback URL
+        """
+        now = time.time()
+        with self._url_cache_lock:
+            cached = self._url_cache.get(filename)
+            if cached and cached[1] - now > min_expiry_seconds:
+                self._url_cache.move_to_end(filename)
+                return cached[0], int(cached[1] - now - min_expiry_seconds)
+        
+        s3_key = self._get_s3_key(filename)
+        # For private buckets, generate a presigned URL (valid for 1 hour)
+        try:
+            # The client's regional endpoint_url already yields the region-specific
+            # host, so the URL needs no rewriting
+            presigned_url = self._presign_get(s3_key)
             
-            # Replace generic s3.amazonaws.com with region-specific endpoint
-            # This prevents 307 redirects that break the signature
-            if '.s3.amazonaws.com/' in presigned_url:
-                presigned_url = presigned_url.replace(
-                    '.s3.amazonaws.com/',
-                    f'.s3.{self.region}.amazonaws.com/'
-                )
+            with self._url_cache_lock:
+                self._url_cache[filename] = (presigned_url, now + PRESIGNED_URL_EXPIRY)
+                self._url_cache.move_to_end(filename)
+                if len(self._url_cache) > PRESIGNED_URL_CACHE_SIZE:
+                    self._url_cache.popitem(last=False)
             
-            return presigned_url
+            return presigned_url, max(PRESIGNED_URL_EXPIRY - min_expiry_seconds, 0)
         except Exception as e:
-            logger.error(f"Error generating presigned URL: {str(e)}")
+            logger.error("Error generating presigned URL: %s", e)
             # Fallback to direct URL (will fail if bucket is private, but better than crashing)
-            return f"https://{self.bucket_name}.s3.{self.region}.amazonaws.com/{s3_key}"
+            return f"https://{self.bucket_name}.s3.{self.region}.amazonaws.com/{s3_key}", 0
+    
+    def presign_many(self, filenames: List[str], min_expiry_seconds: int = PRESIGNED_URL_REFRESH_MARGIN) -> Dict[str, str]:
+        """
+        Get presigned URLs for several files at once (e.g. a page of recordings)
+        
+        Args:
+            filenames: Names of the files to sign
+            min_expiry_seconds: Minimum remaining lifetime for a cached URL to be reused
+        
+        Returns:
+            dict: filename -> URL, in input order
+        """
+        urls = {}
+        misses = []
+        now = time.time()
+        # One lock acquisition for all the cache hits
+        with self._url_cache_lock:
+            for filename in filenames:
+                cached = self._url_cache.get(filename)
+                if cached and cached[1] - now > min_expiry_seconds:
+                    self._url_cache.move_to_end(filename)
+                    urls[filename] = cached[0]
+                else:
+                    misses.append(filename)
+        
+        # Signing is pure-Python HMAC work that holds the GIL, so the misses are
+        # signed inline; fanning them out to the upload pool measured slower
+        for filename in misses:
+            urls[filename] = self.get_file_url(filename, min_expiry_seconds)
+        
+        return {filename: urls[filename] for filename in filenames}
     
     def delete_file(self, filename: str) -> bool:
         """Delete a file from S3."""
@@ -228,46 +485,36 @@ class S3StorageService(StorageService):
                 Bucket=self.bucket_name,
                 Key=s3_key
             )
-            logger.info(f"Successfully deleted file from S3: {s3_key}")
+            self._forget_head(filename)
+            logger.info("Successfully deleted file from S3: %s", s3_key)
             return True
         except ClientError as e:
-            logger.error(f"S3 delete failed: {str(e)}")
+            logger.error("S3 delete failed: %s", e)
             return False
         except Exception as e:
-            logger.error(f"Unexpected error during S3 delete: {str(e)}")
+            logger.error("Unexpected error during S3 delete: %s", e)
             return False
     
     def file_exists(self, filename: str) -> bool:
         """Check if a file exists in S3."""
         try:
-            s3_key = self._get_s3_key(filename)
-            self.s3_client.head_object(
-                Bucket=self.bucket_name,
-                Key=s3_key
-            )
-            return True
+            return self._head(filename) is not None
         except ClientError as e:
-            if e.response.get('Error', {}).get('Code') == '404':
-                return False
-            logger.error(f"Error checking file existence: {str(e)}")
+            logger.error("Error checking file existence: %s", e)
             return False
         except Exception as e:
-            logger.error(f"Unexpected error checking file existence: {str(e)}")
+            logger.error("Unexpected error checking file existence: %s", e)
             return False
     
     def get_file_size(self, filename: str) -> Optional[int]:
         """Get the size of a file in S3."""
         try:
-            s3_key = self._get_s3_key(filename)
-            response = self.s3_client.head_object(
-                Bucket=self.bucket_name,
-                Key=s3_key
-            )
-            return response.get('ContentLength')
+            metadata = self._head(filename)
+            return metadata['ContentLength'] if metadata else None
         except ClientError:
             return None
         except Exception as e:
-            logger.error(f"Error getting file size: {str(e)}")
+            logger.error("Error getting file size: %s", e)
             return None
     
     def download_file(self, filename: str, destination_path: str) -> bool:
@@ -288,13 +535,77 @@ class S3StorageService(StorageService):
                 s3_key,
                 destination_path
             )
-            logger.info(f"Successfully downloaded file from S3: {s3_key} -> {destination_path}")
+            logger.info("Successfully downloaded file from S3: %s -> %s", s3_key, destination_path)
+            return True
+        except ClientError as e:
+            logger.error("S3 download failed: %s", e)
+            return False
+        except Exception as e:
+            logger.error("Unexpected error during S3 download: %s", e)
+            return False
+    
+    def download_bytes(self, filename: str) -> Optional[bytearray]:
+        """
+        Download a file from S3 into memory.
+        
+        Args:
+            filename: Name of the file in S3
+            
+        Returns:
+            File contents (a bytearray, returned as-is to avoid a second full
+            copy), or None if the download failed
+        """
+        try:
+            s3_key = self._get_s3_key(filename)
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)
+            # Stream straight into one buffer sized from the response, without a
+            # temporary file on disk
+            data = bytearray(response.get('ContentLength') or 0)
+            offset = 0
+            for chunk in response['Body'].iter_chunks(chunk_size=1024 * 1024):
+                data[offset:offset + len(chunk)] = chunk
+                offset += len(chunk)
+            del data[offset:]
+            logger.info("Successfully downloaded file from S3: %s (%d bytes)", s3_key, offset)
+            return data
+        except ClientError as e:
+            logger.error("S3 download failed: %s", e)
+            return None
+        except Exception as e:
+            logger.error("Unexpected error during S3 download: %s", e)
+            return None
+    
+    def copy_within_s3(self, src_filename: str, dst_filename: str) -> bool:
+        """
+        Copy a file to another name in the bucket without downloading it.
+        
+        S3 copies the object server-side (as parallel UploadPartCopy calls for
+        objects above the multipart threshold), so no bytes pass through this process.
+        
+        Args:
+            src_filename: Name of the existing file
+            dst_filename: Name for the copy
+        
+        Returns:
+            True if successful, False otherwise
+        """
+        try:
+            src_key = self._get_s3_key(src_filename)
+            dst_key = self._get_s3_key(dst_filename)
+            self.s3_client.copy(
+                CopySource={'Bucket': self.bucket_name, 'Key': src_key},
+                Bucket=self.bucket_name,
+                Key=dst_key,
+                Config=self._transfer_config
+            )
+            self._forget_head(dst_filename)
+            logger.info("Successfully copied file in S3: %s -> %s", src_key, dst_key)
             return True
         except ClientError as e:
-            logger.error(f"S3 download failed: {str(e)}")
+            logger.error("S3 copy failed: %s", e)
             return False
         except Exception as e:
-            logger.error(f"Unexpected error during S3 download: {str(e)}")
+            logger.error("Unexpected error during S3 copy: %s", e)
             return False
     
     def upload_from_path(self, local_path: str, filename: str, content_type: Optional[str] = None) -> dict:
@@ -309,57 +620,49 @@ class S3StorageService(StorageService):
         Returns:
             dict with 'success', 'url', 'filename', 'size' keys
         """
+        # Open once and take the size from the descriptor, rather than
+        # resolving the path twice (getsize() and then open())
+        fd = None
         try:
-            # Get file size first (before opening)
-            file_size = os.path.getsize(local_path)
-            
-            # Open and upload
-            with open(local_path, 'rb') as file_obj:
-                # Secure the filename
-                secure_name = secure_filename(filename)
-                s3_key = self._get_s3_key(secure_name)
-                
-                # Prepare upload arguments
-                extra_args = {}
-                if content_type:
-                    extra_args['ContentType'] = content_type
-                
-                # Upload to S3
-                self.s3_client.upload_fileobj(
-                    file_obj,
-                    self.bucket_name,
-                    s3_key,
-                    ExtraArgs=extra_args
-                )
-                
-                # Generate URL
-                url = self.get_file_url(secure_name)
-                
-                logger.info(f"Successfully uploaded file to S3: {s3_key} ({file_size} bytes)")
-                
-                return {
-                    'success': True,
-                    'url': url,
-                    'filename': secure_name,
-                    'size': file_size
-                }
-                
-        except ClientError as e:
-            error_code = e.response.get('Error', {}).get('Code', 'Unknown')
-            logger.error(f"S3 upload failed: {error_code} - {str(e)}")
-            return {
-                'success': False,
-                'error': f"S3 upload failed: {error_code}",
-                'filename': filename
-            }
-        except Exception as e:
-            logger.error(f"Error uploading from path: {str(e)}")
+            fd = os.open(local_path, os.O_RDONLY)
+            file_size = os.fstat(fd).st_size
+            if hasattr(os, 'posix_fadvise'):
+                # The file is read exactly once, front to back
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            file_obj = os.fdopen(fd, 'rb')
+        except OSError as e:
+            if fd is not None:
+                os.close(fd)
+            logger.error("Error uploading from path: %s", e)
             return {
                 'success': False,
                 'error': str(e),
                 'filename': filename
             }
-
+        
+        with file_obj:
+            return self._do_upload(file_obj, filename, file_size, content_type)
+    
+    def upload_many(self, files: List[Tuple[Union[BinaryIO, str], str, Optional[str]]]) -> List[dict]:
+        """
+        Upload several files to S3 concurrently.
+        
+        Args:
+            files: (file object or local path, filename, content_type) tuples
+            
+        Returns:
+            List of upload result dicts, in the same order as `files`
+        """
+        # All workers share self.s3_client: boto3 clients are thread-safe, unlike
+        # boto3 sessions and resources, so no per-thread client is created
+        executor = _get_executor()
+        futures = []
+        for source, filename, content_type in files:
+            if isinstance(source, str):
+                futures.append(executor.submit(self.upload_from_path, source, filename, content_type))
+            else:
+                futures.append(executor.submit(self.upload_file, source, filename, content_type))
+        return [future.result() for future in futures]
 
 class LocalStorageService(StorageService):
     """Local filesystem implementation of storage service (for testing/fallback)."""
@@ -377,7 +680,7 @@ class LocalStorageService(StorageService):
         
         # Create directory if it doesn't exist
         os.makedirs(self.base_path, exist_ok=True)
-        logger.info(f"Initialized local storage: path={base_path}")
+        logger.info("Initialized local storage: path=%s", base_path)
     
     def _get_file_path(self, filename: str) -> str:
         """Get the full filesystem path for a filename."""
@@ -386,21 +689,21 @@ class LocalStorageService(StorageService):
     def upload_file(self, file_obj: BinaryIO, filename: str, content_type: Optional[str] = None) -> dict:
         """Upload a file to local filesystem."""
         try:
-            secure_name = secure_filename(filename)
+            secure_name = _secure_filename(filename)
             file_path = self._get_file_path(secure_name)
             
-            # Save file
+            # Save file, streaming through a fixed 1 MiB buffer instead of reading
+            # the whole upload into memory; the size comes from the open descriptor
             file_obj.seek(0)
             with open(file_path, 'wb') as f:
-                f.write(file_obj.read())
-            
-            # Get file size
-            file_size = os.path.getsize(file_path)
+                shutil.copyfileobj(file_obj, f, length=1024 * 1024)
+                f.flush()
+                file_size = os.fstat(f.fileno()).st_size
             
             # Generate URL
             url = self.get_file_url(secure_name)
             
-            logger.info(f"Successfully uploaded file locally: {file_path} ({file_size} bytes)")
+            logger.info("Successfully uploaded file locally: %s (%d bytes)", file_path, file_size)
             
             return {
                 'success': True,
@@ -409,7 +712,7 @@ class LocalStorageService(StorageService):
                 'size': file_size
             }
         except Exception as e:
-            logger.error(f"Local upload failed: {str(e)}")
+            logger.error("Local upload failed: %s", e)
             return {
                 'success': False,
                 'error': str(e),
@@ -426,11 +729,11 @@ class LocalStorageService(StorageService):
             file_path = self._get_file_path(filename)
             if os.path.exists(file_path):
                 os.remove(file_path)
-                logger.info(f"Successfully deleted local file: {file_path}")
+                logger.info("Successfully deleted local file: %s", file_path)
                 return True
             return False
         except Exception as e:
-            logger.error(f"Local delete failed: {str(e)}")
+            logger.error("Local delete failed: %s", e)
             return False
     
     def file_exists(self, filename: str) -> bool:
@@ -446,7 +749,7 @@ class LocalStorageService(StorageService):
                 return os.path.getsize(file_path)
             return None
         except Exception as e:
-            logger.error(f"Error getting file size: {str(e)}")
+            logger.error("Error getting file size: %s", e)
             return None
 
 
@@ -463,16 +766,22 @@ def create_storage_service(use_s3: bool = True, workspace_id: str = 'ws-general'
     """
     if use_s3:
         # Check if AWS credentials are available
-        if not os.environ.get('AWS_ACCESS_KEY_ID') or not os.environ.get('AWS_SECRET_ACCESS_KEY'):
+        if not _HAS_AWS_CREDS:
             logger.warning("AWS credentials not found. Falling back to local storage.")
             use_s3 = False
     
     if use_s3:
-        return S3StorageService(
-            bucket_name='liblib-notion',
-            region='eu-central-1',
-            workspace_id=workspace_id
-        )
+        service = _STORAGE_SINGLETONS.get(workspace_id)
+        if service is None:
+            with _storage_singletons_lock:
+                service = _STORAGE_SINGLETONS.get(workspace_id)
+                if service is None:
+                    service = _STORAGE_SINGLETONS[workspace_id] = S3StorageService(
+                        bucket_name='liblib-notion',
+                        region='eu-central-1',
+                        workspace_id=workspace_id
+                    )
+        return service
     else:
         # Fallback to local storage
         from flask import current_app
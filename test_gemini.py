@@ -50,14 +50,12 @@ def test_gemini_api():
             'models/gemini-1.0-pro'               # Oldest fallback
         ]
         
-        selected_model = None
-        for preferred in preferred_models:
-            if preferred in generation_models:
-                selected_model = preferred
-                break
-        
-        if not selected_model:
-            selected_model = generation_models[0]
+        # First preferred model that is available, else the first available one
+        available_models = set(generation_models)
+        selected_model = next(
+            (preferred for preferred in preferred_models if preferred in available_models),
+            generation_models[0]
+        )
         
         print(f"\n🎯 Selected model: {selected_model}")
         
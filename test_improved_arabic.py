@@ -7,10 +7,9 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from app import create_pdf_from_html
 
-def test_improved_arabic_pdf():
-    """Test enhanced Arabic PDF generation"""
-    
-    html_content = """
+# Sample document exercising Arabic shaping, RTL flow, lists and mixed digits
+_ARABIC_TITLE = "اختبار محسن للنصوص العربية"
+_ARABIC_HTML = """
     <div class="bg-cyan-50 p-8 rounded-xl border-2 border-dashed border-cyan-200">
         <h2 class="text-2xl font-bold text-cyan-950 mb-4">اختبار محسن للنصوص العربية</h2>
         
@@ -66,6 +65,9 @@ def test_improved_arabic_pdf():
         </div>
     </div>
     """
+
+def test_improved_arabic_pdf():
+    """Test enhanced Arabic PDF generation"""
     
     print("🔧 اختبار التحسينات الجديدة للنصوص العربية...")
     print("=" * 60)
@@ -77,7 +79,7 @@ def test_improved_arabic_pdf():
         print("   • تشكيل النصوص المحسن")
         print("   • انتظار تحميل الخطوط")
         
-        pdf_buffer = create_pdf_from_html(html_content, "اختبار محسن للنصوص العربية")
+        pdf_buffer = create_pdf_from_html(_ARABIC_HTML, _ARABIC_TITLE)
         
         if pdf_buffer:
             pdf_data = pdf_buffer.getvalue()
@@ -0,0 +1,10 @@
+"""
+WSGI entry point for running the app under a production server:
+
+    gunicorn -k gthread -w 4 --threads 8 wsgi:app
+
+Create or upgrade the database tables once before starting the workers:
+
+    python -c "from wsgi import init_db; init_db()"
+"""
+from app import app, init_db